@@ -0,0 +1,341 @@
+"""
+Benchmarks the song backends over pages saved locally.
+
+Save each song as NAME.html (the rendered wiki page) and/or NAME.json (the api.php answer for SongInfo.page_url),
+where NAME is the page title with underscores, then run:
+
+    python -m cogs.audio.subcogs.music.components.bench_backends PAGES_DIR [--repeat N]
+
+For each backend it prints parse time and bytes per cached SongRecord. The wikitext also goes through
+SongInfo.extract_lyrics on its own, against EXTRACT_TARGET. The html pages are parsed with and without
+PAGE_STRAINER, and streamed through the page end detector to show how much of each page is never read.
+
+Searches go in PAGES_DIR/search as QUERY.html (the Special:Search page) and QUERY.json (the api.php
+list=search answer SongProvider.fetch_api_search asks for), their payloads and parse times are compared.
+Album art goes in PAGES_DIR/images as NAME.EXT (the original) and NAME.thumb.EXT (what thumbnail_url points to),
+their sizes and the time average_color takes on each are compared.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import dataclasses
+import tracemalloc
+
+from . import vocaloid_scraper as vs
+from . import lyrics_grabber as lg
+from .fandom_client import WIKI_URL, HOST_LIMITS
+from .song_provider import PAGE_BATCH, api_search_links
+from .album_art import average_color, THUMBNAIL_WIDTH
+
+
+CHUNK_SIZE = 65536 # What FandomClient.read and Song._request read at a time
+# extract_lyrics has to keep up with a mirror crawl, which gets PAGE_BATCH pages per api.php request
+EXTRACT_TARGET = HOST_LIMITS['vocaloidlyrics.fandom.com'][0] * PAGE_BATCH # Pages per second
+
+BACKENDS = {
+    'html': (vs.Song, '.html'),
+    'wikitext': (lg.WikitextSong, '.json')
+}
+
+def load_pages(folder: str, extension: str) -> list:
+    pages = []
+    for name in sorted(os.listdir(folder)):
+        if name.endswith(extension):
+            with open(os.path.join(folder, name), "rb") as f:
+                pages.append((f"{WIKI_URL}/wiki/{name[:-len(extension)]}", f.read()))
+    return pages
+
+def bench(backend, pages: list, repeat: int) -> dict:
+    found = 0
+    failed = []
+    start = time.perf_counter()
+    for i in range(repeat):
+        for url, content in pages:
+            song = backend(url, load=False)
+            song._parse_content(content)
+            if i == 0:
+                if song.lyrics_found and song.lyrics:
+                    found += 1
+                else:
+                    failed.append(url.rsplit('/', 1)[-1])
+    elapsed = time.perf_counter() - start
+    return {
+        'pages': len(pages),
+        'lyrics': found,
+        'failed': failed,
+        'kb_per_page': sum(len(content) for _, content in pages) / max(1, len(pages)) / 1024,
+        'ms_per_page': elapsed * 1000 / max(1, len(pages) * repeat)
+    }
+
+def deep_size(obj, seen: set) -> int:
+    """Bytes held by obj and everything it refers to that hasn't been counted in seen yet."""
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, tuple):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif dataclasses.is_dataclass(obj):
+        size += sum(deep_size(getattr(obj, field.name), seen) for field in dataclasses.fields(obj))
+    return size
+
+def bench_records(backend, pages: list) -> dict:
+    """
+    Bytes per cached SongRecord, with strings shared between records (interned roles, singers, link titles)
+    counted once like they are in the cache. For html pages also the size of the parse tree a record replaces.
+    """
+    seen = set()
+    records = []
+    trees = []
+    for url, content in pages:
+        song = backend(url, load=False)
+        if isinstance(song, vs.Song):
+            tracemalloc.start()
+            song._load(content)
+            trees.append(tracemalloc.get_traced_memory()[0])
+            tracemalloc.stop()
+            song._parse()
+            song.content.decompose()
+        else:
+            song._parse_content(content)
+        records.append(song.to_record())
+    return {
+        'record_kb': sum(deep_size(record, seen) for record in records) / len(records) / 1024,
+        'lyrics_kb': sum(len("".join(record.lyrics).encode()) for record in records) / len(records) / 1024,
+        'tree_kb': statistics.mean(trees) / 1024 if trees else None
+    }
+
+def bench_strainer(pages: list, repeat: int) -> dict:
+    """Parse time and tree size of html pages with PAGE_STRAINER and without it, as pages were parsed before."""
+    times = {True: [], False: []}
+    sizes = {True: [], False: []}
+    mismatched = []
+    for url, content in pages:
+        records = []
+        for strained in (True, False):
+            options = {'parse_only': vs.PAGE_STRAINER} if strained else {}
+            started = time.perf_counter()
+            for _ in range(repeat):
+                vs.bs(content, vs.PARSER, **options).decompose()
+            times[strained].append((time.perf_counter() - started) / repeat)
+
+            tracemalloc.start()
+            tree = vs.bs(content, vs.PARSER, **options)
+            sizes[strained].append(tracemalloc.get_traced_memory()[0])
+            tracemalloc.stop()
+            song = vs.Song(url, load=False)
+            song.content = tree
+            song._parse()
+            records.append(song.to_record())
+            tree.decompose()
+        if records[0] != records[1]:
+            mismatched.append(url.rsplit('/', 1)[-1])
+    return {
+        'strained_ms': statistics.mean(times[True]) * 1000,
+        'full_ms': statistics.mean(times[False]) * 1000,
+        'strained_kb': statistics.mean(sizes[True]) / 1024,
+        'full_kb': statistics.mean(sizes[False]) / 1024,
+        'mismatched': mismatched
+    }
+
+def bench_search(folder: str, repeat: int) -> dict:
+    """Payload size and parse time of the Special:Search page against the api.php list=search answer for each query."""
+    sizes = {'html': [], 'json': []}
+    times = {'html': [], 'json': []}
+    differing = []
+    for name in sorted(os.listdir(folder)):
+        query, extension = os.path.splitext(name)
+        if extension != '.html' or not os.path.exists(os.path.join(folder, query + '.json')):
+            continue
+        with open(os.path.join(folder, name), "rb") as f:
+            html = f.read()
+        with open(os.path.join(folder, query + '.json'), "rb") as f:
+            data = f.read()
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            song = vs.Song(query, load=False)
+            song._parse_content(html)
+        times['html'].append((time.perf_counter() - started) / repeat)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            links = api_search_links(json.loads(data))
+        times['json'].append((time.perf_counter() - started) / repeat)
+        sizes['html'].append(len(html))
+        sizes['json'].append(len(data))
+
+        if [link['title'] for link in song.links] != [link['title'] for link in links]:
+            differing.append(query)
+    if not sizes['html']:
+        return None
+    return {
+        'queries': len(sizes['html']),
+        **{f"{kind}_kb": statistics.mean(sizes[kind]) / 1024 for kind in sizes},
+        **{f"{kind}_ms": statistics.mean(times[kind]) * 1000 for kind in times},
+        'differing': differing
+    }
+
+def channel_gap(first: int, second: int) -> int:
+    """Largest difference in one color channel between two 0xRRGGBB colors."""
+    return max(abs((first >> shift & 255) - (second >> shift & 255)) for shift in (16, 8, 0))
+
+def bench_images(folder: str, repeat: int) -> dict:
+    """Transfer size and average_color time of each full-size image against its scaled thumbnail."""
+    sizes = {'full': [], 'thumb': []}
+    times = {'full': [], 'thumb': []}
+    gaps = []
+    for name in sorted(os.listdir(folder)):
+        stem, extension = os.path.splitext(name)
+        thumb = os.path.join(folder, f"{stem}.thumb{extension}")
+        if stem.endswith('.thumb') or not os.path.exists(thumb):
+            continue
+        colors = {}
+        for kind, path in (('full', os.path.join(folder, name)), ('thumb', thumb)):
+            with open(path, "rb") as f:
+                data = f.read()
+            started = time.perf_counter()
+            for _ in range(repeat):
+                colors[kind] = average_color(data)
+            times[kind].append((time.perf_counter() - started) / repeat)
+            sizes[kind].append(len(data))
+        gaps.append(channel_gap(colors['full'], colors['thumb']))
+    if not gaps:
+        return None
+    return {
+        'images': len(gaps),
+        **{f"{kind}_kb": statistics.mean(sizes[kind]) / 1024 for kind in sizes},
+        **{f"{kind}_ms": statistics.mean(times[kind]) * 1000 for kind in times},
+        'worst_gap': max(gaps)
+    }
+
+def bench_extract_lyrics(pages: list, repeat: int) -> dict:
+    """Pages per second through SongInfo.extract_lyrics alone, the wikitext is pulled out of the api answers first."""
+    texts = []
+    for _, content in pages:
+        for page in json.loads(content).get('query', {}).get('pages', {}).values():
+            if page.get('revisions'):
+                texts.append(page['revisions'][0].get('*', ''))
+    info = lg.SongInfo()
+    rates = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for text in texts:
+            info.extract_lyrics(text)
+        rates.append(len(texts) / (time.perf_counter() - started))
+    return {
+        'pages': len(texts),
+        'kb_per_page': sum(len(text.encode()) for text in texts) / max(1, len(texts)) / 1024,
+        'pages_per_second': statistics.median(rates)
+    }
+
+def bench_streaming(pages: list, repeat: int) -> dict:
+    """Bytes read and parse time per html page with the early exit on and off, and the detector's cost per chunk."""
+    read = []
+    detect = []
+    worst_chunk = 0.0
+    full_parse = []
+    cut_parse = []
+    mismatched = []
+    for url, content in pages:
+        until = vs.Song(url, load=False).end_detector()
+        size = len(content)
+        spent = 0.0
+        for start in range(0, len(content), CHUNK_SIZE):
+            started = time.perf_counter()
+            stop = until(content[start:start + CHUNK_SIZE])
+            elapsed = time.perf_counter() - started
+            spent += elapsed
+            worst_chunk = max(worst_chunk, elapsed)
+            if stop:
+                size = min(len(content), start + CHUNK_SIZE)
+                break
+        read.append(size)
+        detect.append(spent)
+
+        records = []
+        for body, times in ((content, full_parse), (content[:size], cut_parse)):
+            started = time.perf_counter()
+            for _ in range(repeat):
+                song = vs.Song(url, load=False)
+                song._parse_content(body)
+            times.append((time.perf_counter() - started) / repeat)
+            records.append(song.to_record())
+        if records[0] != records[1]:
+            # The cut page has to give exactly what the whole page gives
+            mismatched.append(url.rsplit('/', 1)[-1])
+
+    return {
+        'kb_full': sum(len(content) for _, content in pages) / len(pages) / 1024,
+        'kb_read': sum(read) / len(pages) / 1024,
+        'cut_short': sum(size < len(content) for size, (_, content) in zip(read, pages)),
+        'detect_ms': statistics.mean(detect) * 1000,
+        'worst_chunk_ms': worst_chunk * 1000,
+        'full_ms': statistics.mean(full_parse) * 1000,
+        'cut_ms': statistics.mean(cut_parse) * 1000,
+        'mismatched': mismatched
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Parse saved song pages with both backends and compare them.")
+    parser.add_argument("folder")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, (backend, extension) in BACKENDS.items():
+        pages = load_pages(args.folder, extension)
+        if not pages:
+            print(f"{name}: no *{extension} pages in {args.folder}")
+            continue
+        result = bench(backend, pages, args.repeat)
+        print(f"{name}: {result['lyrics']}/{result['pages']} pages with lyrics, "
+              f"{result['kb_per_page']:.1f} KB and {result['ms_per_page']:.2f} ms per page")
+        if result['failed']:
+            print(f"  no lyrics: {', '.join(result['failed'])}")
+        result = bench_records(backend, pages)
+        tree = f", the parse tree it replaces held {result['tree_kb']:.1f} KB" if result['tree_kb'] else ""
+        print(f"  {result['record_kb']:.1f} KB per cached SongRecord ({result['lyrics_kb']:.1f} KB of it lyrics){tree}")
+
+    pages = load_pages(args.folder, '.json')
+    if pages:
+        result = bench_extract_lyrics(pages, args.repeat)
+        verdict = "meets" if result['pages_per_second'] >= EXTRACT_TARGET else "MISSES"
+        print(f"extract_lyrics: {result['pages_per_second']:.0f} pages/s over {result['pages']} pages of "
+              f"{result['kb_per_page']:.1f} KB, {verdict} the {EXTRACT_TARGET} pages/s a mirror crawl can deliver")
+
+    pages = load_pages(args.folder, '.html')
+    if pages:
+        result = bench_strainer(pages, args.repeat)
+        print(f"strainer ({vs.PARSER}): {result['strained_ms']:.2f} ms and {result['strained_kb']:.0f} KB of tree per page, "
+              f"{result['full_ms']:.2f} ms and {result['full_kb']:.0f} KB without it")
+        if result['mismatched']:
+            print(f"  strained page parsed differently: {', '.join(result['mismatched'])}")
+
+        result = bench_streaming(pages, args.repeat)
+        print(f"streaming: {result['cut_short']}/{len(pages)} pages cut short, "
+              f"{result['kb_read']:.1f} of {result['kb_full']:.1f} KB read per page, "
+              f"parse {result['cut_ms']:.2f} ms instead of {result['full_ms']:.2f} ms")
+        print(f"  end detector {result['detect_ms']:.2f} ms per page, worst {CHUNK_SIZE // 1024} KB chunk {result['worst_chunk_ms']:.2f} ms")
+        if result['mismatched']:
+            print(f"  cut page parsed differently: {', '.join(result['mismatched'])}")
+
+    search_folder = os.path.join(args.folder, 'search')
+    result = bench_search(search_folder, args.repeat) if os.path.isdir(search_folder) else None
+    if result:
+        print(f"search: {result['queries']} queries, api.php {result['json_kb']:.1f} KB parsed in {result['json_ms']:.2f} ms, "
+              f"Special:Search {result['html_kb']:.1f} KB parsed in {result['html_ms']:.2f} ms")
+        if result['differing']:
+            print(f"  different results: {', '.join(result['differing'])}")
+
+    image_folder = os.path.join(args.folder, 'images')
+    result = bench_images(image_folder, args.repeat) if os.path.isdir(image_folder) else None
+    if result:
+        print(f"album art: {result['images']} images, {THUMBNAIL_WIDTH}px thumbnail {result['thumb_kb']:.1f} KB "
+              f"and {result['thumb_ms']:.2f} ms per color, original {result['full_kb']:.1f} KB and {result['full_ms']:.2f} ms")
+        print(f"  colors differ by at most {result['worst_gap']} per channel")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import time
+import asyncio
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Least-recently-used cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def get(self, key, default=None):
+        entry = self.data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.data[key]
+            self.misses += 1
+            return default
+
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key, default=None):
+        """Like get, but without touching recency or the hit/miss counters."""
+        entry = self.data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return default
+        return entry[1]
+
+    def set(self, key, value) -> None:
+        self.data[key] = (time.monotonic() + self.ttl, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self.data.pop(key, None)
+        return entry[1] if entry else default
+
+    def clear(self) -> None:
+        self.data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self.data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one task whose result every caller shares."""
+
+    def __init__(self) -> None:
+        self.calls = {}
+        self.waiting = {}
+        self.started = 0
+        self.shared = 0
+
+    def __len__(self) -> int:
+        return len(self.calls)
+
+    async def do(self, key, func, *args):
+        task = self.calls.get(key)
+        if task is None:
+            task = self.start(key, func, *args)
+        else:
+            self.shared += 1
+
+        self.waiting[key] = self.waiting.get(key, 0) + 1
+        try:
+            # Shielded so one impatient caller cancelling doesn't cancel the fetch for everyone else
+            return await asyncio.shield(task)
+        finally:
+            self.waiting[key] -= 1
+            if not self.waiting[key]:
+                del self.waiting[key]
+
+    def start(self, key, func, *args) -> asyncio.Task:
+        """Starts a call without waiting on it, later callers of do() with the same key join it."""
+        self.started += 1
+        task = asyncio.create_task(func(*args))
+        self.calls[key] = task
+        task.add_done_callback(lambda t: self.forget(key, t))
+        return task
+
+    def cancel_idle(self, key) -> bool:
+        """Cancels the call for key, but only if nobody is waiting on its result."""
+        task = self.calls.get(key)
+        if task is None or self.waiting.get(key):
+            return False
+        return task.cancel()
+
+    def forget(self, key, task: asyncio.Task) -> None:
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved even if every caller went away
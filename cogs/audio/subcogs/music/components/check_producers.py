@@ -0,0 +1,109 @@
+"""
+Checks Song's producer extraction against infobox "Producer(s)" rows written the way the wiki renders them.
+Add a row here whenever a page's credits come out wrong, then run:
+
+    python -m cogs.audio.subcogs.music.components.check_producers
+"""
+from bs4 import BeautifulSoup as bs
+
+from . import vocaloid_scraper as vs
+
+
+def link(name: str) -> str:
+    return f'<a href="/wiki/Producer:{name}" title="Producer:{name}">{name}</a>'
+
+# (row html, expected (name, role, link) credits)
+CASES = [
+    (
+        f"{link('DECO*27')} (music, lyrics)<br />{link('Rockwell')} (arrangement)<br />{link('OTOIRO')} (video)",
+        [
+            ('DECO*27', 'music, lyrics', '/wiki/Producer:DECO*27'),
+            ('Rockwell', 'arrangement', '/wiki/Producer:Rockwell'),
+            ('OTOIRO', 'video', '/wiki/Producer:OTOIRO')
+        ]
+    ),
+    (
+        f"{link('kemu')} (music, lyrics, arrangement)<br />Yoshida Yasei (illustration)",
+        [
+            ('kemu', 'music, lyrics, arrangement', '/wiki/Producer:kemu'),
+            ('Yoshida Yasei', 'illustration', None)
+        ]
+    ),
+    (
+        f"{link('Mitchie M')} and {link('Cosmo@Bousou-P')} (music)<br />Mera Shiroki, nakuri (illustration)",
+        [
+            ('Mitchie M', 'music', '/wiki/Producer:Mitchie M'),
+            ('Cosmo@Bousou-P', 'music', '/wiki/Producer:Cosmo@Bousou-P'),
+            ('Mera Shiroki', 'illustration', None),
+            ('nakuri', 'illustration', None)
+        ]
+    ),
+    (
+        f"{link('PinocchioP')} &amp; {link('Giga')} / {link('TeddyLoid')} (music)<br /><!-- video credit -->"
+        f"<span>{link('wowaka')} feat. {link('LOLI.COM')}</span> (lyrics)",
+        [
+            ('PinocchioP', 'music', '/wiki/Producer:PinocchioP'),
+            ('Giga', 'music', '/wiki/Producer:Giga'),
+            ('TeddyLoid', 'music', '/wiki/Producer:TeddyLoid'),
+            ('wowaka', 'lyrics', '/wiki/Producer:wowaka'),
+            ('LOLI.COM', 'lyrics', '/wiki/Producer:LOLI.COM')
+        ]
+    ),
+    (
+        f"{link('ryo')} (music)<br /><br />{link('Sakura Yu')} (illustration, video)<br />",
+        [
+            ('ryo', 'music', '/wiki/Producer:ryo'),
+            ('Sakura Yu', 'illustration, video', '/wiki/Producer:Sakura Yu')
+        ]
+    ),
+    (
+        f"{link('A')} (music) and B (illustration)",
+        [
+            ('A', 'music', '/wiki/Producer:A'),
+            ('B', 'illustration', None)
+        ]
+    ),
+    (
+        "Yasuo (music)/ kz (lyrics)",
+        [
+            ('Yasuo', 'music', None),
+            ('kz', 'lyrics', None)
+        ]
+    ),
+    (
+        f"{link('ryo')} (supercell) (music)<br />{link('DECO*27')}, {link('Rockwell')} (arrangement) (mix)",
+        [
+            ('ryo', 'supercell, music', '/wiki/Producer:ryo'),
+            ('DECO*27', 'arrangement, mix', '/wiki/Producer:DECO*27'),
+            ('Rockwell', 'arrangement, mix', '/wiki/Producer:Rockwell')
+        ]
+    ),
+    (
+        f"{link('kz')} (music, {link('livetune')})<br />Unknown",
+        [
+            ('kz', 'music, livetune', '/wiki/Producer:kz'),
+            ('Unknown', None, None)
+        ]
+    ),
+]
+
+def producers(row_html: str) -> list:
+    song = vs.Song("https://vocaloidlyrics.fandom.com/wiki/Check", load=False)
+    row = bs(f"<table><tr><td>{row_html}</td></tr></table>", vs.PARSER).find('tr')
+    song._Song__extract_producers(row)
+    return [(producer['name'], producer['role'], producer['link']) for producer in song.producers]
+
+def main() -> None:
+    failed = 0
+    for row_html, expected in CASES:
+        found = producers(row_html)
+        if found != expected:
+            failed += 1
+            print(f"Mismatch for {row_html}\n  expected {expected}\n  found    {found}")
+    print(f"{len(CASES) - failed}/{len(CASES)} producer rows match")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import urllib.parse
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+
+
+USER_AGENT = os.getenv('USER_AGENT')
+WIKI_URL = "https://vocaloidlyrics.fandom.com"
+
+# Request priorities, lower goes first when a host's budget is exhausted
+PAGE = 0        # A user is waiting on this page (/lyrics, button clicks, album art)
+SEARCH = 1      # Autocomplete and fallback searches
+BACKGROUND = 2  # Index rebuilds and anything speculative
+
+# Requests per second and burst size per host
+HOST_LIMITS = {
+    'vocaloidlyrics.fandom.com': (4, 8),
+    'static.wikia.nocookie.net': (10, 20)
+}
+DEFAULT_LIMIT = (4, 8)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class FandomError(Exception):
+    pass
+
+class TokenBucket:
+    """Token bucket whose waiters are served in priority order rather than arrival order."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.waiters = []
+        self.counter = itertools.count()
+        self.timer = None
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, priority: int = PAGE) -> None:
+        self.refill()
+        if not self.waiters and self.tokens >= 1 and time.monotonic() >= self.paused_until:
+            self.tokens -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), future))
+        self.schedule()
+        await future
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for a while, used when the host answers 429."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def dispatch(self) -> None:
+        self.timer = None
+        self.refill()
+        if time.monotonic() >= self.paused_until:
+            while self.waiters and self.tokens >= 1:
+                _, _, future = heapq.heappop(self.waiters)
+                if future.done():
+                    continue # The waiter was cancelled
+                future.set_result(None)
+                self.tokens -= 1
+        self.schedule()
+
+    def schedule(self) -> None:
+        if self.timer or not self.waiters:
+            return
+        now = time.monotonic()
+        delay = max(self.paused_until - now, (1 - self.tokens) / self.rate, 0)
+        self.timer = asyncio.get_running_loop().call_later(delay, self.dispatch)
+
+def retry_after(headers) -> float|None:
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class FandomClient:
+    """Long-lived, connection-pooled HTTP client shared by everything that talks to Fandom."""
+
+    def __init__(self, concurrency: int = 8, keepalive: float = 60, timeout: float = 10, retries: int = 3) -> None:
+        self.concurrency = concurrency
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.retries = retries
+        self.session = None
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.buckets = {}
+        self.throttled = 0
+        self.cut_short = 0
+
+    async def start(self) -> None:
+        if self.session and not self.session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency * 2,
+            limit_per_host=self.concurrency,
+            keepalive_timeout=self.keepalive,
+            ttl_dns_cache=300
+        )
+        headers = {'User-Agent': USER_AGENT} if USER_AGENT else None
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+
+    async def close(self) -> None:
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    def bucket(self, url: str) -> TokenBucket:
+        host = urllib.parse.urlparse(url).hostname or ""
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(*HOST_LIMITS.get(host, DEFAULT_LIMIT))
+        return self.buckets[host]
+
+    def backoff(self, attempt: int, base: float = 0.5, cap: float = 30) -> float:
+        delay = min(cap, base * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def read(self, response: aiohttp.ClientResponse, max_bytes: int = None, until=None) -> bytes:
+        if not max_bytes and not until:
+            return await response.read()
+        if max_bytes and (response.content_length or 0) > max_bytes:
+            raise FandomError(f"{response.url} is larger than {max_bytes} bytes")
+        content = bytearray()
+        async for chunk in response.content.iter_chunked(65536):
+            content += chunk
+            if max_bytes and len(content) > max_bytes:
+                raise FandomError(f"{response.url} is larger than {max_bytes} bytes")
+            if until and until(chunk):
+                # The rest of the body is never read, the connection is dropped instead of reused
+                self.cut_short += 1
+                break
+        return bytes(content)
+
+    async def get(self, url: str, params: dict = None, priority: int = PAGE) -> bytes:
+        _, content, _ = await self.request(url, params=params, priority=priority)
+        return content
+
+    async def api(self, priority: int = PAGE, **params) -> dict:
+        """Calls the wiki's MediaWiki api.php and returns the decoded JSON."""
+        content = await self.get(f"{WIKI_URL}/api.php", params={**params, 'format': 'json'}, priority=priority)
+        try:
+            return json.loads(content)
+        except ValueError as e:
+            raise FandomError(f"Malformed API response: {e}") from e
+
+    async def request(self, url: str, headers: dict = None, params: dict = None, priority: int = PAGE, max_bytes: int = None, until=None) -> tuple:
+        """
+        Returns (status, body, headers). 304 responses come back with an empty body.
+        Bodies over max_bytes are abandoned with a FandomError instead of being read in full.
+        until is called with each chunk as it arrives, reading stops early once it returns True.
+        """
+        if not self.session:
+            await self.start()
+        bucket = self.bucket(url)
+
+        for attempt in range(self.retries + 1):
+            await bucket.acquire(priority)
+            try:
+                async with self.semaphore:
+                    async with self.session.get(url, headers=headers, params=params) as response:
+                        if response.status in RETRY_STATUSES and attempt < self.retries:
+                            delay = retry_after(response.headers) or self.backoff(attempt)
+                            if response.status == 429:
+                                # Everyone sharing this host backs off, not just this request
+                                self.throttled += 1
+                                bucket.pause(delay)
+                        else:
+                            response.raise_for_status()
+                            content = await self.read(response, max_bytes, until) if response.status != 304 else b""
+                            return response.status, content, response.headers
+            except aiohttp.ClientResponseError as e:
+                raise FandomError(f"Failed to retrieve {url}: {e}") from e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    raise FandomError(f"Failed to retrieve {url}: {e}") from e
+                delay = self.backoff(attempt)
+            await asyncio.sleep(delay)
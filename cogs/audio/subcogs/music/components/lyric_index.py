@@ -0,0 +1,61 @@
+import re
+import math
+import unicodedata
+from array import array
+from collections import defaultdict, Counter
+
+
+# Japanese, Chinese and Korean are written without spaces, so they're indexed by character trigrams
+CJK = re.compile('[\u3040-\u30ff\u31f0-\u31ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff66-\uff9f]+')
+WORD = re.compile(r'\w+')
+
+def grams(text: str) -> set:
+    text = unicodedata.normalize('NFKC', text).casefold()
+    result = set()
+    for run in CJK.findall(text):
+        if len(run) < 3:
+            result.add(run)
+        else:
+            result.update(run[i:i + 3] for i in range(len(run) - 2))
+    # Romaji and translations are matched by whole words
+    result.update(WORD.findall(CJK.sub(' ', text)))
+    return result
+
+class LyricIndex:
+    """
+    Immutable in-memory inverted index from lyric n-grams to songs.
+    Songs are ranked by the summed rarity (idf) of the query grams they contain.
+    """
+
+    def __init__(self, songs) -> None:
+        self.songs = []
+        postings = defaultdict(list)
+        for title, url, lyrics in songs:
+            song_id = len(self.songs)
+            self.songs.append((title, url))
+            for gram in grams(lyrics):
+                postings[gram].append(song_id)
+        self.postings = {gram: array('I', ids) for gram, ids in postings.items()}
+
+    def __len__(self) -> int:
+        return len(self.songs)
+
+    def search(self, snippet: str, limit: int = 10, min_match: float = 0.6) -> list:
+        query = grams(snippet)
+        lists = [(gram, self.postings[gram]) for gram in query if gram in self.postings]
+        if not lists:
+            return []
+
+        total = len(self.songs)
+        scores = Counter()
+        matched = Counter()
+        for _, ids in lists:
+            weight = math.log(1 + total / len(ids))
+            for song_id in ids:
+                scores[song_id] += weight
+                matched[song_id] += 1
+
+        # Most of the snippet has to be there, a couple of shared common words isn't a match
+        needed = max(1, math.ceil(len(query) * min_match))
+        ranked = sorted((i for i in scores if matched[i] >= needed), key=lambda i: -scores[i])
+        return [{'href': self.songs[i][1], 'title': self.songs[i][0]} for i in ranked[:limit]]
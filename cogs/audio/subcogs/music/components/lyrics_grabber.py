@@ -1,8 +1,128 @@
-import requests
+import urllib.parse
+import asyncio
+import html
+import json
 import re
 
-# This is the updated version of the vocaloid_scraper.py file. Not yet implemented, but fully functional. 
-# I highly recommend using this over the fuckery in the last file, if you choose to do so.
+import requests
+
+from .fandom_client import FandomError, PAGE
+from .vocaloid_scraper import SongRecord
+
+# This is the updated version of the vocaloid_scraper.py file. The lyrics cog uses it through WikitextSong
+# when LYRICS_BACKEND=wikitext. I highly recommend using this over the fuckery in the last file, if you choose to do so.
+
+# Compiled once at import since they run over every page
+DESCRIPTION_PATTERN = re.compile(r"\|description\s*=\s*(.*?)\n", re.DOTALL)
+IMAGE_PATTERN = re.compile(r"\|image\s*=\s*(.*?)\n", re.DOTALL)
+SECTION_PATTERN = re.compile(r'^(=+)\s*(.*?)\s*\1$')
+TAB_PATTERN = re.compile(r'^[^=|{}<>\[\]]+=$')
+POEM_PATTERN = re.compile(r'</?poem>', re.IGNORECASE)
+BR_PATTERN = re.compile(r'<br\s*/?>', re.IGNORECASE)
+SHARED_PATTERN = re.compile(r'\{\{\s*shared\s*\|\s*(\d+)\s*\}\}', re.IGNORECASE)
+COLSPAN_PATTERN = re.compile(r'colspan\s*=\s*"?(\d+)', re.IGNORECASE)
+HEADER_PATTERN = re.compile(r"'''(.*?)'''")
+SONG_TITLE_PATTERN = re.compile(r"\|\s*songtitle\s*=\s*(.*?)\n")
+BOLD_PATTERN = re.compile(r"'''(.+?)'''")
+ITALIC_PATTERN = re.compile(r"''(.+?)''")
+WIKILINK_PATTERN = re.compile(r"\[\[(?:[^\[\]|]*\|)?([^\[\]|]*)\]\]")
+EXTERNAL_LINK_PATTERN = re.compile(r"\[https?://\S+\s+([^\]]+)\]")
+TAG_PATTERN = re.compile(r"</?[a-zA-Z][^>]*>")
+CELL_SPLIT_PATTERN = re.compile(r'\{\{|\[\[|\}\}|\]\]|\|\||!!')
+CELL_ATTRIBUTE_PATTERN = re.compile(r'[{}\[\]|]')
+DATE_PATTERN = re.compile(r"\|(original upload date|date)\s*=\s*\{\{Date\|(.*?)\}\}")
+SINGER_PATTERN = re.compile(r'\|singer\s*=\s*(.*?)\n')
+ARTIST_PATTERN = re.compile(r'\[\[([^\[\]]+?)\]\]|\{\{Singer\|([^\}]+?)\}\}')
+PRODUCER_PATTERN = re.compile(r'\|producer\s*=\s*(.*?)\n')
+PRODUCER_ROLE_PATTERN = re.compile(r"\[\[([^\[\]]+)\]\]\s*\(([^)]+)\)")
+VIEWS_PATTERN = re.compile(r"\#views\s*=\s*(.*?)(\n|$)")
+LINK_LINE_PATTERN = re.compile(r'\|[ \t]*link[ \t]*=[ \t]*(.*)')
+LINK_PATTERN = re.compile(r'\[([^\s]+) ([^\]]+)\](?: <small>(.*?)</small>)?')
+EXTRA_LINKS_PATTERN = re.compile(r'(?<=\n==External Links==\n)(.*?)(?=\n==)', re.DOTALL)
+EXTRA_LINK_PATTERN = re.compile(r'\[(https?://[^\s]+)\s+([^\]]+)\]')
+CONTENT_WARNING_PATTERN = re.compile(r"\{\{(Questionable|Explicit)\|(.*?)\}\}")
+DISAMBIGUATION_PATTERN = re.compile(r"\{\{\s*disambig", re.IGNORECASE)
+DISAMBIGUATION_LINK_PATTERN = re.compile(r"^\*.*?\[\[([^\[\]|]+)(?:\|([^\[\]]+))?\]\]", re.MULTILINE)
+
+def clean_wikitext(text: str, formatting: bool = True) -> str:
+    """Turns wikitext markup into plain text, bold and italics become Discord markdown unless formatting is off."""
+    # Most lyric lines have no markup at all, each pass only runs when its marker is there
+    if '<' in text:
+        text = TAG_PATTERN.sub('', BR_PATTERN.sub('\n', text))
+    if '[' in text:
+        text = EXTERNAL_LINK_PATTERN.sub(r'\1', WIKILINK_PATTERN.sub(r'\1', text))
+    if "''" in text:
+        text = BOLD_PATTERN.sub(r'**\1**' if formatting else r'\1', text)
+        text = ITALIC_PATTERN.sub(r'*\1*' if formatting else r'\1', text)
+    return html.unescape(text) if '&' in text else text
+
+def split_cells(line: str) -> list:
+    """Splits a table line on the || (or !!) between inline cells, ignoring pipes inside templates and links."""
+    if '||' not in line and '!!' not in line:
+        return [line]
+    cells = []
+    start = depth = 0
+    # Only the brackets and separators are visited, not every character
+    for match in CELL_SPLIT_PATTERN.finditer(line):
+        token = match.group()
+        if token in ('{{', '[['):
+            depth += 1
+        elif token in ('}}', ']]'):
+            depth = max(0, depth - 1)
+        elif not depth:
+            cells.append(line[start:match.start()])
+            start = match.end()
+    cells.append(line[start:])
+    return cells
+
+def split_cell(cell: str) -> tuple:
+    """Returns (columns spanned, text) for one cell, reading colspan="N" and {{shared|N}}."""
+    attributes, text = "", cell
+    depth = 0
+    if '|' in cell:
+        for match in CELL_ATTRIBUTE_PATTERN.finditer(cell):
+            char = match.group()
+            if char in '{[':
+                depth += 1
+            elif char in '}]':
+                depth = max(0, depth - 1)
+            elif not depth:
+                attributes, text = cell[:match.start()], cell[match.end():]
+                break
+
+    span = 1
+    for source in (attributes, text):
+        match = SHARED_PATTERN.search(source) or COLSPAN_PATTERN.search(source)
+        if match:
+            span = int(match.group(1))
+            break
+    if '{{' in text:
+        text = SHARED_PATTERN.sub('', text)
+    return span, BR_PATTERN.sub('\n', text).strip() if '<' in text else text.strip()
+
+def table_columns(rows: list) -> dict:
+    """Turns parsed table rows into {column name: lyrics}. The first row is the header if every cell in it is bold."""
+    rows = [row for row in rows if row]
+    names = []
+    if rows and all(HEADER_PATTERN.fullmatch(text) for _, text in rows[0]):
+        names = [HEADER_PATTERN.fullmatch(text).group(1).strip() for _, text in rows.pop(0)]
+    width = max([len(names)] + [sum(span for span, _ in row) for row in rows])
+    names += ['Original' if i == 0 else f"Column {i + 1}" for i in range(len(names), width)]
+
+    columns = [[] for _ in names]
+    for row in rows:
+        position = 0
+        for span, text in row:
+            if len(row) == 1 and span > 1:
+                span = width # {{shared}} lines belong to every column
+            text = clean_wikitext(text)
+            for column in columns[position:position + span]:
+                column.append(text)
+            position += span
+        for column in columns[position:]:
+            column.append("") # Keep every column's lines aligned
+    return {name: "\n".join(column) for name, column in zip(names, columns)}
+
 
 class SongInfo():
     def __init__(self):
@@ -13,6 +133,7 @@ class SongInfo():
 
         self.page_input = None
         self.page_title = None
+        self.page_content = None
         self.page_content_warning = None
         self.page_image = None
         self.page_date = None
@@ -22,6 +143,7 @@ class SongInfo():
         self.page_links = None
         self.page_extra_links = None
         self.page_description = None
+        self.page_song_title = None
         self.page_lyrics = None
 
     def get_query(self, query):
@@ -41,97 +163,140 @@ class SongInfo():
         else:
             return "Failed to retrieve content", response.status_code
 
+    def page_url(self, title):
+        params = {'action': 'query', 'prop': 'revisions', 'rvprop': 'content', 'titles': title, 'redirects': 1, 'format': 'json'}
+        return f"{self.wiki_url}/api.php?{urllib.parse.urlencode(params)}"
+
     def get_page(self, title):
         self.page_input = title
-        api_url = f"{self.wiki_url}/api.php?action=query&prop=revisions&rvprop=content&titles={title}&format=json"
-        response = requests.get(api_url)
+        response = requests.get(self.page_url(title))
         if response.status_code == 200:
-            data = response.json()
-            pages = data['query']['pages']
-            for _, page_data in pages.items():
-                self.page_title = page_data['title']
-                revisions = page_data.get('revisions', [])
-                if revisions:
-                    content = revisions[0].get('*', 'No content available.')
-                    #print(content)
-
-                    self.page_content_warning = self.extract_content_warning(content)
-                    self.page_image = self.extract_image(content)
-                    self.page_description = self.extract_description(content)
-                    self.page_lyrics = self.extract_lyrics(content)
-                    self.page_date = self.extract_date(content)
-                    self.page_singers = self.extract_singers(content)
-                    self.page_producers = self.extract_producers(content)
-                    self.page_views = self.extract_views(content)
-                    self.page_links = self.extract_links(content)
-                    self.page_extra_links = self.extract_extra_links(content)
-
-                    return False
-                else:
-                    return "Failed to access content for '{self.page_title}'."
+            return self.parse_page(response.json())
         else:
             return "Failed to retrieve content", response.status_code
-        
+
+    def parse_page(self, data):
+        pages = data['query']['pages']
+        for _, page_data in pages.items():
+            self.page_title = page_data['title']
+            revisions = page_data.get('revisions', [])
+            if revisions:
+                content = revisions[0].get('*', 'No content available.')
+                self.page_content = content
+
+                self.page_content_warning = self.extract_content_warning(content)
+                self.page_image = self.extract_image(content)
+                self.page_description = self.extract_description(content)
+                self.page_song_title = self.extract_song_title(content)
+                self.page_lyrics = self.extract_lyrics(content)
+                self.page_date = self.extract_date(content)
+                self.page_singers = self.extract_singers(content)
+                self.page_producers = self.extract_producers(content)
+                self.page_views = self.extract_views(content)
+                self.page_links = self.extract_links(content)
+                self.page_extra_links = self.extract_extra_links(content)
+
+                return False
+            else:
+                return f"Failed to access content for '{self.page_title}'."
+
+    def extract_song_title(self, content):
+        match = SONG_TITLE_PATTERN.search(content)
+        return " ".join(clean_wikitext(match.group(1), formatting=False).split()) if match else False
+
     def extract_description(self, content):
-        match = re.search(r"\|description\s*=\s*(.*?)\n", content, re.DOTALL)
+        match = DESCRIPTION_PATTERN.search(content)
         return match.group(1).strip() if match else False
 
     def extract_image(self, content):
-        match = re.search(r"\|image\s*=\s*(.*?)\n", content, re.DOTALL)
+        match = IMAGE_PATTERN.search(content)
         if match:
             return f"{self.wiki_url}/wiki/File:{match.group(1).replace(' ', '_')}"
         return False
 
     def extract_lyrics(self, content):
-        lyrics_block = re.search(r'==Lyrics==\s*(.*?)(\n\s*\n|\Z)', content, re.DOTALL).group(1)
-        tabber_block = re.search(r'<tabber>(.*?)</tabber>', lyrics_block, re.DOTALL)
-        tabs = tabber_block.group(1).split('|-|') if tabber_block else [lyrics_block]
+        # One pass over the lines of the page: find ==Lyrics==, then walk its tabs, tables, rows and cells.
+        # Returns {tab name: {column name: lyrics}}, or {} when the page has no lyrics section.
         lyrics = {}
+        in_section = False
+        tab_name = 'Untitled'
+        loose = []      # Lines of a tab that has no table (plain or <poem> lyrics)
+        table = None    # Rows of the table being read, each a list of (span, text) cells
+        row = None
+
+        def finish_tab():
+            nonlocal loose
+            text = "\n".join(loose).strip()
+            if text and tab_name not in lyrics:
+                lyrics[tab_name] = {'Original': text}
+            loose = []
 
-        for tab_content in tabs:
-            tab_name_match = re.search(r'\n(.*?)\s*=', tab_content)
-            tab_name = tab_name_match.group(1) if tab_name_match else 'Untitled'
-
-            columns_match = re.search(r'\{\| style="width:100%"\s*(.*?)\|-', tab_content, re.DOTALL)
-            column_names = ['Original']
-            if columns_match:
-                column_names = [name.strip() for name in re.sub(r"[|'''\{\}]", "", columns_match.group(1)).split("\n") if name.strip()]
-            lyrics_dict = {col: [] for col in column_names}
-
-            # Replace <br /> with newline to treat it as a line break
-            tab_content = re.sub(r'<br />', '\n', tab_content)
-
-            # Handle the {{shared|3}} by distributing the lyrics across columns
-            for row in tab_content.split('|-'):
-                lyrics_parts = [part.strip() for part in row.split("\n") if part.strip()]
-                
-                # Check if this row is a shared one (contains {{shared|3}})
-                if '{{shared|3}}' in row:
-                    # Take the row and add it to all columns (this row will have the same content for each column)
-                    shared_lyrics = [part for part in row.split("\n") if part.strip() and part != '{{shared|3}}']
-                    for idx, col in enumerate(column_names):
-                        lyrics_dict[col].append("\n".join(shared_lyrics))  # Add the shared lyrics to all columns
-                else:
-                    # Normal lyrics row: add to respective columns if there's a match
-                    if len(lyrics_parts) == len(column_names):
-                        for idx, part in enumerate(lyrics_parts):
-                            lyrics_dict[column_names[idx]].append(part.replace('|', ''))
-
-            lyrics[tab_name] = {col: "\n".join(lyrics_dict[col]) for col in lyrics_dict}
+        for line in content.split('\n'):
+            stripped = line.strip()
+            heading = SECTION_PATTERN.match(stripped) if stripped.startswith('=') else None
 
+            if not in_section:
+                in_section = bool(heading) and heading.group(2) == 'Lyrics'
+                continue
+
+            if table is None:
+                if heading and heading.group(1) == '==':
+                    break
+                if stripped.startswith('<tabber>'):
+                    stripped = stripped[len('<tabber>'):].strip()
+                if stripped.startswith('|-|'):
+                    # Tab separator, the next tab's name may follow on the same line
+                    finish_tab()
+                    stripped = stripped[3:].strip()
+                if stripped.startswith('</tabber>'):
+                    break
+                elif stripped.startswith('{|'):
+                    finish_tab()
+                    table, row = [], None
+                elif TAB_PATTERN.match(stripped):
+                    finish_tab()
+                    tab_name = stripped[:-1].strip()
+                elif stripped and not POEM_PATTERN.fullmatch(stripped):
+                    loose.append(clean_wikitext(POEM_PATTERN.sub('', stripped)).rstrip('\n'))
+                continue
+
+            if stripped.startswith('|}'):
+                if row:
+                    table.append(row)
+                lyrics[tab_name] = table_columns(table)
+                table, row = None, None
+            elif stripped.startswith('|-'):
+                if row:
+                    table.append(row)
+                row = []
+            elif stripped.startswith('|+'):
+                continue # Table caption
+            elif stripped.startswith(('|', '!')):
+                if row is None:
+                    row = []
+                row.extend(split_cell(cell) for cell in split_cells(stripped[1:]))
+            elif row:
+                # A cell that carries on over several lines
+                span, text = row[-1]
+                more = BR_PATTERN.sub('\n', stripped)
+                row[-1] = (span, f"{text}\n{more}")
+
+        if table is not None:
+            # Unclosed table at the end of the page
+            lyrics[tab_name] = table_columns(table + [row] if row else table)
+        finish_tab()
         return lyrics
 
     def extract_date(self, content):
-        match = re.search(r"\|(original upload date|date)\s*=\s*\{\{Date\|(.*?)\}\}", content)
+        match = DATE_PATTERN.search(content)
         return match.group(2).strip() if match else False
 
-    def extract_singers(self, content): 
-        match = re.search(r'\|singer\s*=\s*(.*?)\n', content)
-        
+    def extract_singers(self, content):
+        match = SINGER_PATTERN.search(content)
+
         if match:
             singer_line = match.group(1)
-            artist_pattern = r'\[\[([^\[\]]+?)\]\]|\{\{Singer\|([^\}]+?)\}\}'
-            matches = re.findall(artist_pattern, singer_line)
+            matches = ARTIST_PATTERN.findall(singer_line)
             singers = []
 
             for match in matches:
@@ -144,56 +309,190 @@ class SongInfo():
         return False
 
     def extract_producers(self, content):
-        match = re.search(r'\|producer\s*=\s*(.*?)\n', content)
+        match = PRODUCER_PATTERN.search(content)
         if match:
             producer_line = match.group(1)
-            matches = re.findall(r"\[\[([^\[\]]+)\]\]\s*\(([^)]+)\)", producer_line)
+            matches = PRODUCER_ROLE_PATTERN.findall(producer_line)
             producers = [(producer[0], producer[1], f"{self.wiki_url}/wiki/{producer[0].replace(' ', '_')}") for producer in matches]
 
             return producers if producers else False
         return False
 
     def extract_views(self, content):
-        match = re.search(r"\#views\s*=\s*(.*?)(\n|$)", content)
+        match = VIEWS_PATTERN.search(content)
         return match.group(1) if match else False
 
     def extract_links(self, content):
-        line_with_links = re.search(r'\|link = (.*)', content).group(1)
-        pattern = r'\[([^\s]+) ([^\]]+)\](?: <small>(.*?)</small>)?'
+        match = LINK_LINE_PATTERN.search(content)
+        if not match:
+            return False
         links = [
             (f"{name} {small_text}" if small_text else name, url)
-            for url, name, small_text in re.findall(pattern, line_with_links)
+            for url, name, small_text in LINK_PATTERN.findall(match.group(1))
         ]
         return links if links else False
 
     def extract_extra_links(self, content):
-        match = re.search(r'(?<=\n==External Links==\n)(.*?)(?=\n==)', content, re.DOTALL)
+        match = EXTRA_LINKS_PATTERN.search(content)
         if match:
             section_content = match.group(1)
-            links = [(name, url) for url, name in re.findall(r'\[(https?://[^\s]+)\s+([^\]]+)\]', section_content)]
+            links = [(name, url) for url, name in EXTRA_LINK_PATTERN.findall(section_content)]
             return links if links else False
         return False
 
     def extract_content_warning(self, content):
-        match = re.search(r"\{\{(Questionable|Explicit)\|(.*?)\}\}", content)
+        match = CONTENT_WARNING_PATTERN.search(content)
         return (match.group(1), match.group(2)) if match else False
 
 
-page_title = "BUTCHER_VANITY"
-page_query = "Miss Death's Idol"
+class WikitextSong:
+    """
+    Wikitext (api.php) backend for the lyrics cog.
+    Exposes the same attributes and loading methods as vocaloid_scraper.Song, so either can be used interchangeably.
+    """
+
+    def __init__(self, query: str, load: bool = True) -> None:
+        self.input = query
+        self.is_link = True
+        self.query = query
+        self.info = SongInfo()
+
+        self.error_message = ""
+
+        self.image = ""
+        self.title = ""
+        self.date = ""
+        self.singers = []
+        self.producers = []
+        self.views = ""
+        self.links = []
+        self.description = ""
+        self.lyrics = []
+
+        self.links_found = None
+        self.lyrics_found = None
+
+        if load:
+            try:
+                response = requests.get(self.url)
+                response.raise_for_status()
+                self._parse_content(response.content)
+            except requests.exceptions.RequestException as e:
+                self.error_message = e
+
+    @classmethod
+    async def fetch(cls, query: str, client, priority: int = PAGE) -> "WikitextSong":
+        song = cls(query, load=False)
+        try:
+            content = await client.get(song.url, priority=priority)
+        except FandomError as e:
+            song.error_message = e
+            return song
+        await song.parse(content)
+        return song
+
+    @classmethod
+    def from_batch(cls, data: dict) -> list:
+        """Parses every page of a multi-title revisions query (titles=a|b|c) into its own song."""
+        songs = []
+        for page_id, page in data.get('query', {}).get('pages', {}).items():
+            if 'missing' in page or 'title' not in page:
+                continue
+            song = cls(f"{SongInfo().wiki_url}/wiki/{page['title'].replace(' ', '_')}", load=False)
+            song._parse_data({'query': {'pages': {page_id: page}}})
+            songs.append(song)
+        return songs
+
+    def to_record(self) -> SongRecord:
+        return SongRecord.from_song(self)
+
+    def end_detector(self) -> None:
+        # api.php answers with just the wikitext, there's no trailing page to skip
+        return None
+
+    @property
+    def page_title(self) -> str:
+        path = urllib.parse.urlparse(self.query).path
+        return urllib.parse.unquote(path.split('/wiki/', 1)[-1]).replace('_', ' ')
+
+    @property
+    def url(self) -> str:
+        return self.info.page_url(self.page_title)
+
+    async def parse(self, content: bytes) -> None:
+        await asyncio.to_thread(self._parse_content, content)
+
+    def _parse_content(self, content: bytes) -> None:
+        try:
+            data = json.loads(content)
+        except ValueError as e:
+            self.error_message = f"Missing or broken lyrics: {e}"
+            self.lyrics_found = False
+            return
+        self._parse_data(data)
+
+    def _parse_data(self, data: dict) -> None:
+        try:
+            pages = data['query']['pages']
+            page = next(iter(pages.values()))
+            revisions = page.get('revisions')
+            if not revisions:
+                self.error_message = f"Failed to access content for '{page.get('title', self.page_title)}'."
+                self.lyrics_found = False
+                return
+
+            wikitext = revisions[0].get('*', '')
+            if DISAMBIGUATION_PATTERN.search(wikitext):
+                self.title = page['title']
+                self.__extract_disambiguation(wikitext)
+            else:
+                self.info.parse_page(data)
+                self.__set_info()
+        except Exception as e:
+            self.error_message = f"Missing or broken lyrics: {e}"
+            self.lyrics_found = False
+            return
+        self.lyrics_found = True
+
+    def __extract_disambiguation(self, wikitext: str) -> None:
+        for title, label in DISAMBIGUATION_LINK_PATTERN.findall(wikitext):
+            href = f"{self.info.wiki_url}/wiki/{title.strip().replace(' ', '_')}"
+            self.links.append({'href': href, 'title': (label or title).strip()})
+
+    def __set_info(self) -> None:
+        info = self.info
+        # The infobox title like the html backend shows, not the page name
+        self.title = info.page_song_title or info.page_title
+        if info.page_image:
+            self.image = info.page_image.replace('/wiki/File:', '/wiki/Special:FilePath/')
+        self.date = info.page_date or ""
+        self.singers = [name for name, _ in info.page_singers or []]
+        self.producers = [{'name': name, 'role': role, 'link': link} for name, role, link in info.page_producers or []]
+        self.views = info.page_views or ""
+        self.links = [{'href': href, 'title': title} for title, href in info.page_links or []]
+        self.description = info.page_description or ""
+
+        # Song.lyrics is one string per column (original, romanized, translated) of the first table
+        tabs = info.page_lyrics or {}
+        first_tab = next(iter(tabs.values()), {})
+        self.lyrics = [column for column in first_tab.values()]
+
 
-song_info = SongInfo()
-song_info.get_page(page_query)
+if __name__ == "__main__":
+    page_title = "BUTCHER_VANITY"
+    page_query = "Miss Death's Idol"
 
-print("Title:", song_info.page_title)
-#print("Description:", song_info.page_description)
-print("Singers:", song_info.page_singers)
-print("Producers:", song_info.page_producers)
-print("Image:", song_info.page_image)
-print("Date:", song_info.page_date)
-print("Views:", song_info.page_views)
-print("Links:", song_info.page_links)
-print("Extra Links:", song_info.page_extra_links)
-print("Content Warning:", song_info.page_content_warning)
-print("Lyrics:", song_info.page_lyrics)
+    song_info = SongInfo()
+    song_info.get_page(page_query)
 
+    print("Title:", song_info.page_title)
+    #print("Description:", song_info.page_description)
+    print("Singers:", song_info.page_singers)
+    print("Producers:", song_info.page_producers)
+    print("Image:", song_info.page_image)
+    print("Date:", song_info.page_date)
+    print("Views:", song_info.page_views)
+    print("Links:", song_info.page_links)
+    print("Extra Links:", song_info.page_extra_links)
+    print("Content Warning:", song_info.page_content_warning)
+    print("Lyrics:", song_info.page_lyrics)
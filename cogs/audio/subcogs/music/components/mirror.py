@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import urllib.parse
+from dataclasses import asdict
+
+from .vocaloid_scraper import SongRecord, Link, Producer
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS songs (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL,
+    title TEXT NOT NULL,
+    url TEXT NOT NULL,
+    wikitext TEXT NOT NULL,
+    record TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+FTS_SCHEMA = "CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts USING fts5(title, lyrics)"
+KEY_FORMAT = "mediawiki" # Bumped whenever title_key changes, older rows are re-keyed on open
+
+def title_key(title: str) -> str:
+    """A page title the way MediaWiki normalises it: spaces for underscores and only the first letter uppercased."""
+    title = " ".join(title.replace('_', ' ').split())
+    return title[:1].upper() + title[1:]
+
+def url_title(url: str) -> str:
+    path = urllib.parse.urlparse(url).path
+    return urllib.parse.unquote(path.split('/wiki/', 1)[-1]).replace('_', ' ')
+
+def dump_record(record: SongRecord) -> str:
+    return json.dumps(asdict(record), ensure_ascii=False)
+
+def load_record(data: str) -> SongRecord:
+    fields = json.loads(data)
+    fields['singers'] = tuple(fields['singers'])
+    fields['producers'] = tuple(Producer(*producer) for producer in fields['producers'])
+    fields['links'] = tuple(Link(*link) for link in fields['links'])
+    fields['lyrics'] = tuple(fields['lyrics'])
+    return SongRecord(**fields)
+
+class SongMirror:
+    """
+    Local SQLite copy of parsed song pages with a full-text index over titles and lyrics.
+    Every call blocks, so the provider runs them with asyncio.to_thread.
+    """
+
+    def __init__(self, path: str = None) -> None:
+        self.data_folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+        self.path = path or os.path.join(self.data_folder, "lyrics_mirror.db")
+        self.lock = threading.Lock()
+        self.db = None
+        self.fts = True
+        self.hits = 0
+        self.misses = 0
+
+    def open(self) -> None:
+        if self.db:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        try:
+            self.db.execute(FTS_SCHEMA)
+        except sqlite3.OperationalError as e:
+            # Some SQLite builds ship without FTS5, title search falls back to LIKE
+            print(f"Lyrics mirror full-text search unavailable: {e}")
+            self.fts = False
+        # Case-insensitive matching is only for searching, keys stay case-sensitive like the wiki's titles
+        self.db.create_function('casefold', 1, lambda text: text.casefold() if text else text, deterministic=True)
+        self.db.commit()
+        self.rekey()
+
+    def rekey(self) -> None:
+        """Moves rows keyed by an older title_key to the current one, keys come from each row's url."""
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'key_format'").fetchone()
+        if row and row[0] == KEY_FORMAT:
+            return
+        with self.db:
+            rows = self.db.execute("SELECT id, url FROM songs").fetchall()
+            self.db.executemany("UPDATE songs SET key = ? WHERE id = ?", [(title_key(url_title(url)), id) for id, url in rows])
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('key_format', ?)", (KEY_FORMAT,))
+
+    def close(self) -> None:
+        if self.db:
+            self.db.close()
+            self.db = None
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM songs").fetchone()[0]
+
+    def store(self, pages: list) -> None:
+        """Saves (record, wikitext) pairs, replacing older copies of the same page."""
+        now = time.time()
+        with self.lock, self.db:
+            for record, wikitext in pages:
+                key = title_key(url_title(record.query))
+                row = self.db.execute(
+                    "INSERT INTO songs (key, title, url, wikitext, record, updated) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET title=excluded.title, url=excluded.url, wikitext=excluded.wikitext, "
+                    "record=excluded.record, updated=excluded.updated RETURNING id",
+                    (key, record.title, record.query, wikitext, dump_record(record), now)
+                ).fetchone()
+                if self.fts:
+                    self.db.execute("DELETE FROM songs_fts WHERE rowid = ?", row)
+                    self.db.execute(
+                        "INSERT INTO songs_fts (rowid, title, lyrics) VALUES (?, ?, ?)",
+                        (row[0], record.title, "\n".join(record.lyrics))
+                    )
+
+    def remove(self, titles: list) -> int:
+        """Drops the given pages, returns how many were actually mirrored."""
+        removed = 0
+        with self.lock, self.db:
+            for title in titles:
+                row = self.db.execute("DELETE FROM songs WHERE key = ? RETURNING id", (title_key(title),)).fetchone()
+                if row:
+                    removed += 1
+                    if self.fts:
+                        self.db.execute("DELETE FROM songs_fts WHERE rowid = ?", row)
+        return removed
+
+    def get(self, url: str) -> SongRecord|None:
+        with self.lock:
+            row = self.db.execute("SELECT record FROM songs WHERE key = ?", (title_key(url_title(url)),)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return load_record(row[0])
+
+    def search(self, query: str, limit: int = 25) -> list:
+        """Titles and lyrics matching query, best first, in the same shape as Fandom search results."""
+        with self.lock:
+            if self.fts:
+                # Every word is quoted so user input can't be read as FTS query syntax
+                terms = " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+                if not terms:
+                    return []
+                rows = self.db.execute(
+                    "SELECT songs.title, songs.url FROM songs_fts JOIN songs ON songs.id = songs_fts.rowid "
+                    "WHERE songs_fts MATCH ? ORDER BY bm25(songs_fts, 10.0, 1.0) LIMIT ?",
+                    (terms, limit)
+                ).fetchall()
+            else:
+                rows = self.db.execute(
+                    "SELECT title, url FROM songs WHERE casefold(title) LIKE ? LIMIT ?",
+                    (f"%{' '.join(query.casefold().split())}%", limit)
+                ).fetchall()
+        return [{'href': url, 'title': title} for title, url in rows]
+
+    def lyric_texts(self) -> list:
+        """(title, url, all lyric columns) for every stored song, for building the snippet index."""
+        with self.lock:
+            rows = self.db.execute("SELECT title, url, record FROM songs").fetchall()
+        return [(title, url, "\n".join(json.loads(record)['lyrics'])) for title, url, record in rows]
+
+    def get_meta(self, key: str, default: str = None) -> str|None:
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
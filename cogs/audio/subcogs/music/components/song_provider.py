@@ -0,0 +1,483 @@
+import os
+import time
+import asyncio
+import hashlib
+import json
+
+from . import vocaloid_scraper as vs
+from . import lyrics_grabber as lg
+from .album_art import AlbumColors
+from .cache import TTLCache, SingleFlight
+from .fandom_client import FandomClient, FandomError, WIKI_URL, PAGE, SEARCH, BACKGROUND
+from .mirror import SongMirror, title_key, url_title
+from .title_index import TitleIndex
+from .lyric_index import LyricIndex
+
+
+# Both backends expose the same Song interface: HTML scraping of the rendered page, or the page's wikitext from api.php
+BACKENDS = {
+    'html': vs.Song,
+    'wikitext': lg.WikitextSong
+}
+
+# Speculative page loads for the top autocomplete results
+PREFETCH_COUNT = 2
+PREFETCH_CONCURRENCY = 2
+PREFETCH_MAX_BYTES = 2 * 1024 * 1024
+
+# Stop downloading song pages once the parts the scraper reads have arrived, LYRICS_STREAM=0 reads them in full
+STREAM_PAGES = os.getenv('LYRICS_STREAM', '1') != '0'
+
+# Titles per api.php revisions query (titles=a|b|c), the API's limit for page content
+PAGE_BATCH = 50
+# Batched requests a bulk lookup keeps in flight at once
+BULK_CONCURRENCY = 4
+
+MIRROR_CURSOR = 'recentchanges_cursor' # "timestamp rcid rcid...", the ids are the changes at that second already synced
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.casefold().split())
+
+def title_url(title: str) -> str:
+    return f"{WIKI_URL}/wiki/{title.replace(' ', '_')}"
+
+def api_search_links(data: dict) -> list:
+    """An api.php list=search answer as the [{'href', 'title'}] list Song.links gives for a search page."""
+    return [{'href': title_url(page['title']), 'title': page['title']} for page in data['query']['search']]
+
+class CachedPage:
+    def __init__(self, song: vs.SongRecord, headers) -> None:
+        self.song = song
+        self.etag = headers.get('ETag')
+        self.last_modified = headers.get('Last-Modified')
+        self.fetched_at = time.monotonic()
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+    def validators(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+class SongProvider:
+    """Everything the lyrics cog needs from Fandom, with caching in front of the scraper."""
+
+    def __init__(self, client: FandomClient, backend: str = None, fresh_for: float = 3600, stale_for: float = 86400) -> None:
+        self.client = client
+        self.backend = BACKENDS[backend or os.getenv('LYRICS_BACKEND', 'html')]
+        self.colors = AlbumColors(client)
+        # 'html' scrapes Special:Search, 'api' asks api.php's list=search for a small JSON answer
+        self.search_backend = os.getenv('LYRICS_SEARCH', 'html')
+        self.search_cache = TTLCache(maxsize=2048, ttl=600)
+
+        # Pages younger than fresh_for are served as-is, pages younger than stale_for are served
+        # immediately and revalidated in the background, anything older is revalidated before use.
+        self.fresh_for = fresh_for
+        self.stale_for = stale_for
+        self.page_cache = TTLCache(maxsize=256, ttl=7 * 86400)
+        self.song_keys = TTLCache(maxsize=8192, ttl=30 * 86400)
+        self.revalidations = 0
+        self.not_modified = 0
+        self.flights = SingleFlight()
+        self.tasks = set()
+
+        self.title_index = None
+        self.index_hits = 0
+        self.index_misses = 0
+
+        self.prefetches = TTLCache(maxsize=1024, ttl=60) # owner -> flight keys it started
+        self.prefetch_running = set()
+        self.prefetched = TTLCache(maxsize=512, ttl=600) # warmed urls nobody has asked for yet
+        self.prefetch_started = 0
+        self.prefetch_hits = 0
+        self.prefetch_skipped = 0
+        self.prefetch_cancelled = 0
+
+        # Optional local copy of the wiki, consulted before Fandom when LYRICS_MIRROR is set
+        self.mirror = SongMirror(os.getenv('LYRICS_MIRROR_PATH')) if os.getenv('LYRICS_MIRROR') else None
+        self.lyric_index = None
+
+    async def start(self) -> None:
+        if self.mirror:
+            await asyncio.to_thread(self.mirror.open)
+
+    async def close(self) -> None:
+        for key in list(self.prefetch_running):
+            self.flights.cancel_idle(key)
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.mirror:
+            await asyncio.to_thread(self.mirror.close)
+
+    async def search(self, query: str) -> list:
+        key = normalize_query(query)
+        links = self.search_cache.get(key)
+        if links is not None:
+            return links
+
+        if self.mirror:
+            links = await asyncio.to_thread(self.mirror.search, key)
+            if links:
+                return links
+
+        return await self.flights.do(('search', key), self.fetch_search, key)
+
+    def cancel_search(self, query: str) -> bool:
+        """Abandons an in-flight search nobody is waiting on anymore."""
+        return self.flights.cancel_idle(('search', normalize_query(query)))
+
+    async def fetch_search(self, key: str) -> list:
+        if self.search_backend == 'api':
+            return await self.fetch_api_search(key)
+
+        song = await vs.Song.fetch(key, self.client, priority=SEARCH)
+        # Only cache answers from Fandom (including "no results"), never transport errors
+        if song.links_found is not None:
+            self.search_cache.set(key, song.links)
+        return song.links
+
+    async def fetch_api_search(self, key: str, limit: int = 25) -> list:
+        """Same results as the Special:Search page, as a few KB of JSON instead of a full HTML page."""
+        try:
+            data = await self.client.api(
+                priority=SEARCH, action='query', list='search', srsearch=key,
+                srnamespace=0, srlimit=limit, srprop='', srinfo=''
+            )
+            links = api_search_links(data)
+        except (FandomError, KeyError) as e:
+            print(f"Error searching Fandom for {key}: {e}")
+            return []
+        self.search_cache.set(key, links)
+        return links
+
+    async def suggest(self, query: str, limit: int = 25) -> list:
+        """Autocomplete candidates, answered from the title index when it has any."""
+        if self.title_index:
+            titles = self.title_index.search(query, limit)
+            if titles:
+                self.index_hits += 1
+                return [{'href': title_url(title), 'title': title} for title in titles]
+        self.index_misses += 1
+        return await self.search(query)
+
+    async def all_titles(self) -> list:
+        titles = []
+        params = {'action': 'query', 'list': 'allpages', 'apnamespace': 0, 'apfilterredir': 'nonredirects', 'aplimit': 'max'}
+        while True:
+            data = await self.client.api(priority=BACKGROUND, **params)
+            titles.extend(page['title'] for page in data['query']['allpages'])
+            if 'continue' not in data:
+                break
+            params.update(data['continue'])
+        return titles
+
+    async def refresh_index(self) -> None:
+        titles = await self.all_titles()
+        # Building touches every title, keep it off the event loop
+        self.title_index = await asyncio.to_thread(TitleIndex, titles)
+
+    async def crawl_mirror(self, titles: list = None, strict: bool = False) -> list:
+        """
+        Downloads titles (every song page by default) into the mirror, PAGE_BATCH pages per request.
+        Returns the titles that were stored. Failed batches are skipped unless strict.
+        """
+        if titles is None:
+            titles = await self.all_titles()
+
+        stored = []
+        for i in range(0, len(titles), PAGE_BATCH):
+            batch = titles[i:i + PAGE_BATCH]
+            try:
+                songs = await self.fetch_batch(batch, BACKGROUND)
+            except (FandomError, ValueError) as e:
+                if strict:
+                    raise
+                print(f"Error crawling {len(batch)} pages into the lyrics mirror: {e}")
+                continue
+
+            # Disambiguation and broken pages have nothing worth serving, they stay with Fandom
+            pages = [(song.to_record(), song.info.page_content) for song in songs if song.lyrics_found and song.lyrics]
+            await asyncio.to_thread(self.mirror.store, pages)
+            stored.extend(url_title(record.query) for record, _ in pages)
+        return stored
+
+    async def fetch_batch(self, titles: list, priority: int = PAGE) -> list:
+        """Up to PAGE_BATCH pages in one api.php request, parsed into WikitextSongs."""
+        content = await self.client.get(lg.SongInfo().page_url("|".join(titles)), priority=priority)
+        return await asyncio.to_thread(lg.WikitextSong.from_batch, json.loads(content))
+
+    async def bulk_songs(self, titles: list):
+        """
+        Yields a SongRecord for each title that has lyrics, in the order they arrive rather than the order given.
+        Mirrored songs come first, the rest are fetched PAGE_BATCH per request with BULK_CONCURRENCY requests at a time.
+        """
+        missing = titles
+        if self.mirror:
+            records = await asyncio.to_thread(lambda: [self.mirror.get(title_url(title)) for title in titles])
+            missing = [title for title, record in zip(titles, records) if record is None]
+            for record in records:
+                if record:
+                    yield record
+
+        semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+        async def fetch(batch):
+            async with semaphore:
+                return await self.fetch_batch(batch, SEARCH)
+
+        tasks = [asyncio.ensure_future(fetch(missing[i:i + PAGE_BATCH])) for i in range(0, len(missing), PAGE_BATCH)]
+        try:
+            for next_batch in asyncio.as_completed(tasks):
+                try:
+                    songs = await next_batch
+                except (FandomError, ValueError) as e:
+                    print(f"Error fetching a batch of songs: {e}")
+                    continue
+                for song in songs:
+                    if song.lyrics_found and song.lyrics:
+                        yield song.to_record()
+        finally:
+            # The caller may stop early, nothing should keep downloading for it
+            for task in tasks:
+                task.cancel()
+
+    async def producer_titles(self, producer: str) -> tuple:
+        """Returns (page title, song titles) for a producer, read from the links on their wiki page."""
+        title = producer if ':' in producer else f"Producer:{producer}"
+        params = {'action': 'query', 'prop': 'links', 'titles': title, 'redirects': 1, 'plnamespace': 0, 'pllimit': 'max'}
+        titles = []
+        while True:
+            data = await self.client.api(priority=SEARCH, **params)
+            for page in data['query']['pages'].values():
+                if 'missing' in page:
+                    return None, []
+                title = page['title']
+                titles.extend(link['title'] for link in page.get('links', []))
+            if 'continue' not in data:
+                break
+            params.update(data['continue'])
+        return title, list(dict.fromkeys(titles))
+
+    async def sync_mirror(self) -> tuple:
+        """
+        Brings the mirror up to date from the wiki's recent changes, starting at the cursor saved by the last sync.
+        Without a cursor the whole wiki is crawled first. Returns (pages stored, pages removed).
+        """
+        cursor = await asyncio.to_thread(self.mirror.get_meta, MIRROR_CURSOR)
+        now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        if cursor is None:
+            stored = await self.crawl_mirror()
+            await asyncio.to_thread(self.mirror.set_meta, MIRROR_CURSOR, now)
+            return len(stored), 0
+
+        since, *seen = cursor.split()
+        changed, removed, latest, latest_ids = await self.recent_changes(since, {int(rcid) for rcid in seen})
+        dropped = await asyncio.to_thread(self.mirror.remove, list(removed)) if removed else 0
+        # Strict, so a failed batch leaves the cursor where it was and the next sync retries it
+        stored = await self.crawl_mirror(list(changed), strict=True) if changed else []
+
+        # Pages that lost their lyrics (now a disambiguation, blanked...) shouldn't be served from the mirror either
+        stored_keys = {title_key(title) for title in stored}
+        emptied = [title for title in changed if title_key(title) not in stored_keys]
+        if emptied:
+            # Most of these are pages that never had lyrics, only count the ones that were mirrored
+            dropped += await asyncio.to_thread(self.mirror.remove, emptied)
+
+        for title in changed.keys() | removed:
+            self.page_cache.pop(title_url(title))
+        if changed or removed:
+            self.search_cache.clear()
+
+        await asyncio.to_thread(self.mirror.set_meta, MIRROR_CURSOR, " ".join([latest, *map(str, sorted(latest_ids))]))
+        return len(stored), dropped
+
+    async def refresh_lyric_index(self) -> None:
+        songs = await asyncio.to_thread(self.mirror.lyric_texts)
+        self.lyric_index = await asyncio.to_thread(LyricIndex, songs)
+
+    async def find_by_lyrics(self, snippet: str, limit: int = 10) -> list:
+        """Songs whose lyrics contain most of snippet, best first. Needs the mirror and its lyric index."""
+        if not self.lyric_index:
+            return []
+        return self.lyric_index.search(snippet, limit)
+
+    async def recent_changes(self, since: str, seen: set = frozenset()) -> tuple:
+        """
+        Titles edited, created or undeleted, and titles deleted or moved away, from the given timestamp on.
+        seen holds the rcids at that timestamp that were already handled. Returns (changed, removed, latest
+        timestamp, rcids at the latest timestamp) so the next call can pick up where this one stopped.
+        """
+        changed = {} # Ordered set, pages are re-fetched in the order they changed
+        removed = set()
+        latest = since
+        latest_ids = set(seen)
+        params = {
+            'action': 'query', 'list': 'recentchanges', 'rcnamespace': 0, 'rcdir': 'newer', 'rcstart': since,
+            'rctype': 'edit|new|log', 'rcprop': 'ids|title|timestamp|loginfo', 'rclimit': 'max'
+        }
+        while True:
+            data = await self.client.api(priority=BACKGROUND, **params)
+            for change in data['query']['recentchanges']:
+                # rcstart is inclusive and timestamps only have whole seconds, so the cursor's second comes back.
+                # Only the changes from it that were already handled are skipped, later ones in that second aren't
+                if change['timestamp'] == since and change['rcid'] in seen:
+                    continue
+                if change['timestamp'] > latest:
+                    latest = change['timestamp']
+                    latest_ids = set()
+                latest_ids.add(change['rcid'])
+                title = change['title']
+                if change['type'] == 'log':
+                    action = change.get('logaction')
+                    if action == 'delete':
+                        removed.add(title)
+                        changed.pop(title, None)
+                        continue
+                    if action == 'restore':
+                        # Undeleted, the page is back with its old content
+                        changed[title] = None
+                        removed.discard(title)
+                        continue
+                    if action not in ('move', 'move_redir'):
+                        continue
+                    removed.add(title)
+                    changed.pop(title, None)
+                    title = change.get('logparams', {}).get('target_title')
+                    if not title or change['logparams'].get('target_ns', 0) != 0:
+                        continue
+                changed[title] = None
+                removed.discard(title)
+            if 'continue' not in data:
+                break
+            params.update(data['continue'])
+        return changed, removed, latest, latest_ids
+
+    async def song(self, url: str) -> vs.SongRecord:
+        if self.prefetched.pop(url):
+            self.prefetch_hits += 1
+        elif self.flights.cancel_idle(('prefetch', url)):
+            # Someone is waiting on this page now, load it at full priority and without the prefetch cap
+            self.prefetch_cancelled += 1
+
+        if self.mirror:
+            record = await asyncio.to_thread(self.mirror.get, url)
+            if record:
+                return record
+
+        entry = self.page_cache.get(url)
+        if entry is None:
+            return await self.load_page(url)
+
+        if entry.age < self.fresh_for:
+            return entry.song
+        if entry.age < self.stale_for:
+            self.background(self.load_page(url, entry))
+            return entry.song
+        return await self.load_page(url, entry)
+
+    def song_key(self, url: str) -> str:
+        """Short stable key for a song URL, small enough to embed in a component custom_id."""
+        key = hashlib.blake2b(url.encode(), digest_size=8).hexdigest()
+        self.song_keys.set(key, url)
+        return key
+
+    async def song_by_key(self, key: str, fallback_url: str = None) -> vs.SongRecord|None:
+        url = self.song_keys.get(key) or fallback_url
+        if not url:
+            return None
+        return await self.song(url)
+
+    async def load_page(self, url: str, entry: CachedPage = None) -> vs.SongRecord:
+        return await self.flights.do(('page', url), self.fetch_page, url, entry)
+
+    async def fetch_page(self, url: str, entry: CachedPage = None, priority: int = PAGE, max_bytes: int = None) -> vs.SongRecord:
+        song = self.backend(url, load=False)
+        try:
+            validators = entry.validators() if entry else None
+            until = song.end_detector() if STREAM_PAGES else None
+            status, content, headers = await self.client.request(song.url, validators, priority=priority, max_bytes=max_bytes, until=until)
+        except FandomError as e:
+            if entry:
+                return entry.song
+            song.error_message = e
+            return song.to_record()
+
+        if entry:
+            self.revalidations += 1
+        if status == 304 and entry:
+            self.not_modified += 1
+            entry.fetched_at = time.monotonic()
+            return entry.song
+
+        await song.parse(content)
+        record = song.to_record()
+        if song.lyrics_found:
+            self.page_cache.set(url, CachedPage(record, headers))
+        return record
+
+    def prefetch(self, owner, urls: list) -> None:
+        """
+        Speculatively loads the first few urls at background priority so the page is warm if it gets picked.
+        A newer prefetch from the same owner cancels its older ones. Prefetches run under their own flight key,
+        so a real request never joins one and inherits its priority or size cap.
+        """
+        urls = urls[:PREFETCH_COUNT]
+        for key in self.prefetches.pop(owner, ()):
+            if key[1] not in urls and self.flights.cancel_idle(key):
+                self.prefetch_cancelled += 1
+                # Free the slot now, the done callback only runs on the next loop iteration
+                self.prefetch_running.discard(key)
+
+        started = []
+        for url in urls:
+            key = ('prefetch', url)
+            if key in self.prefetch_running:
+                # Still loading from an earlier call, it stays on the list so the next one can cancel it
+                started.append(key)
+                continue
+            entry = self.page_cache.peek(url)
+            loading = key in self.flights.calls or ('page', url) in self.flights.calls
+            if (entry and entry.age < self.fresh_for) or loading or self.prefetched.peek(url):
+                continue
+            if len(self.prefetch_running) >= PREFETCH_CONCURRENCY:
+                self.prefetch_skipped += 1
+                continue
+
+            self.prefetch_started += 1
+            self.prefetch_running.add(key)
+            task = self.flights.start(key, self.prefetch_page, url, entry)
+            task.add_done_callback(lambda t, key=key: self.prefetch_done(key, t))
+            started.append(key)
+        self.prefetches.set(owner, started)
+
+    async def prefetch_page(self, url: str, entry: CachedPage = None) -> vs.SongRecord|None:
+        # song() answers mirrored pages without Fandom, so there's nothing to warm
+        if self.mirror and await asyncio.to_thread(self.mirror.get, url):
+            return None
+        return await self.fetch_page(url, entry, BACKGROUND, PREFETCH_MAX_BYTES)
+
+    def prefetch_done(self, key, task: asyncio.Task) -> None:
+        self.prefetch_running.discard(key)
+        if task.cancelled() or task.exception():
+            return
+        if task.result() and not task.result().error_message:
+            self.prefetched.set(key[1], True)
+
+    def prefetch_stats(self) -> dict:
+        return {
+            'started': self.prefetch_started,
+            'hits': self.prefetch_hits,
+            'skipped': self.prefetch_skipped,
+            'cancelled': self.prefetch_cancelled,
+            'hit_rate': self.prefetch_hits / self.prefetch_started if self.prefetch_started else 0.0
+        }
+
+    def background(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
@@ -0,0 +1,74 @@
+import re
+import bisect
+from array import array
+from collections import defaultdict, Counter
+
+
+NON_WORD = re.compile(r'[\W_]+')
+
+def normalize_title(title: str) -> str:
+    return " ".join(title.casefold().replace('_', ' ').split())
+
+def trigrams(text: str) -> set:
+    padded = f"  {NON_WORD.sub(' ', text).strip()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TitleIndex:
+    """
+    Immutable in-memory index of wiki page titles.
+    Prefix lookups are a binary search over the sorted normalized titles,
+    fuzzy lookups score titles by how many query trigrams they share.
+    """
+
+    def __init__(self, titles) -> None:
+        pairs = sorted({(normalize_title(title), title) for title in titles})
+        self.keys = [key for key, _ in pairs]
+        self.titles = tuple(title for _, title in pairs)
+
+        postings = defaultdict(list)
+        for i, key in enumerate(self.keys):
+            for gram in trigrams(key):
+                postings[gram].append(i)
+        self.postings = {gram: array('I', ids) for gram, ids in postings.items()}
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def prefix(self, query: str, limit: int = 25) -> list:
+        key = normalize_title(query)
+        start = bisect.bisect_left(self.keys, key)
+        results = []
+        for i in range(start, min(start + limit, len(self.keys))):
+            if not self.keys[i].startswith(key):
+                break
+            results.append(i)
+        return results
+
+    def fuzzy(self, query: str, limit: int = 25, max_postings: int = 20000) -> list:
+        grams = trigrams(normalize_title(query))
+        lists = sorted((self.postings[gram] for gram in grams if gram in self.postings), key=len)
+        if not lists:
+            return []
+
+        # Very common trigrams add little signal but dominate the cost, so stop once the budget is spent
+        scores = Counter()
+        budget = max_postings
+        for ids in lists:
+            if budget < len(ids) and scores:
+                break
+            scores.update(ids)
+            budget -= len(ids)
+
+        threshold = max(2, (len(grams) + 1) // 2)
+        ranked = sorted(
+            (i for i, score in scores.items() if score >= threshold),
+            key=lambda i: (-scores[i], len(self.keys[i]))
+        )
+        return ranked[:limit]
+
+    def search(self, query: str, limit: int = 25) -> list:
+        results = self.prefix(query, limit)
+        if len(results) < limit and len(normalize_title(query)) >= 3:
+            seen = set(results)
+            results += [i for i in self.fuzzy(query, limit) if i not in seen][:limit - len(results)]
+        return [self.titles[i] for i in results]
@@ -1,12 +1,144 @@
 import urllib.parse
+import asyncio
+import sys
 import re
+from dataclasses import dataclass
+from typing import NamedTuple
 
 import requests as r
 from bs4 import BeautifulSoup as bs
+from bs4 import SoupStrainer, NavigableString, Comment
+
+from .fandom_client import FandomError, PAGE
+
+try:
+    import lxml  # noqa: F401
+    PARSER = 'lxml'
+except ImportError:
+    PARSER = 'html.parser'
+
+# Only the parts of a Fandom page that the extractors read get built into a tree,
+# navigation, ads, scripts and comments are skipped while parsing
+PAGE_STRAINER = SoupStrainer('div', class_='mw-parser-output')
+SEARCH_STRAINER = SoupStrainer('ul', class_='unified-search__results')
+
+# Text that joins names in a credit line ("A and B", "A & B", "A / B", "A feat. B") rather than naming anyone
+CREDIT_SEPARATOR = re.compile(r'\s*(?:,|&|/|\+|×|\band\b|\bfeat\.?(?=\s|$)|\bft\.)\s*', re.IGNORECASE)
+
+# The page end detector only looks for these, with regexes over the raw bytes, so no tokenizer runs on the event loop
+CENTER_TAG_PATTERN = re.compile(rb'<(/?)center\b', re.IGNORECASE)
+TABLE_TAG_PATTERN = re.compile(rb'<(/?)table\b', re.IGNORECASE)
+LYRICS_TABLE_PATTERN = re.compile(rb'''<table\b[^>]*\bstyle\s*=\s*(["']?)width:100%\1(?=[\s/>])''', re.IGNORECASE)
+
+
+class PageEndDetector:
+    """
+    Fed a song page chunk by chunk, reports when the infobox (the first <center>) and then the lyrics table
+    have both closed. Nothing after them (comments, recommendations, footer scripts) is read by the extractors.
+    Each chunk only costs a few regex searches over its bytes, pages without a lyrics table are never cut short.
+    """
+
+    def __init__(self) -> None:
+        self.carry = b"" # Unfinished tag at the end of the last chunk
+        self.started = False
+        self.center_depth = 0
+        self.table_depth = 0
+        self.infobox_done = False
+        self.lyrics_done = False
+
+    def __call__(self, chunk: bytes) -> bool:
+        if not self.done:
+            self.scan(chunk)
+        return self.done
+
+    @property
+    def done(self) -> bool:
+        return self.infobox_done and self.lyrics_done
+
+    def scan(self, chunk: bytes) -> None:
+        data = self.carry + chunk
+        # Hold back a tag that hasn't closed yet, it's searched whole with the next chunk
+        cut = data.rfind(b'<')
+        if cut == -1 or data.find(b'>', cut) != -1:
+            cut = len(data)
+        self.carry = data[cut:]
+
+        pos = 0
+        if not self.started:
+            pos = data.find(b'mw-parser-output', 0, cut)
+            if pos == -1:
+                self.carry = data[max(0, cut - 16):] # The class name may be split across chunks
+                return
+            self.started = True
+
+        while not self.infobox_done:
+            match = CENTER_TAG_PATTERN.search(data, pos, cut)
+            if not match:
+                return
+            if not match.group(1):
+                self.center_depth += 1
+            elif self.center_depth:
+                self.center_depth -= 1
+                self.infobox_done = not self.center_depth
+            pos = match.end()
+
+        while not self.lyrics_done:
+            # Same test as the extractor's find('table', style='width:100%'), nested tables are counted after it
+            match = (TABLE_TAG_PATTERN if self.table_depth else LYRICS_TABLE_PATTERN).search(data, pos, cut)
+            if not match:
+                return
+            self.table_depth += -1 if match.group(1) == b'/' else 1
+            self.lyrics_done = not self.table_depth
+            pos = match.end()
+
+
+class Link(NamedTuple):
+    href: str
+    title: str
+
+class Producer(NamedTuple):
+    name: str
+    role: str|None
+    link: str|None
+
+def intern(text):
+    # Roles, singers and link titles repeat across nearly every song, so share one copy of each
+    return sys.intern(text) if isinstance(text, str) else text
+
+@dataclass(frozen=True, slots=True)
+class SongRecord:
+    """Immutable, compact result of parsing a song page. This is what gets cached and rendered."""
+    query: str
+    title: str = ""
+    image: str = ""
+    date: str = ""
+    singers: tuple = ()
+    producers: tuple = ()
+    views: str = ""
+    links: tuple = ()
+    description: str = ""
+    lyrics: tuple = ()
+    error_message: str = ""
+
+    @classmethod
+    def from_song(cls, song) -> "SongRecord":
+        return cls(
+            query=song.query,
+            title=song.title,
+            image=song.image,
+            date=song.date,
+            singers=tuple(intern(singer) for singer in song.singers),
+            producers=tuple(Producer(intern(p['name']), intern(p['role']), p['link']) for p in song.producers),
+            views=song.views,
+            links=tuple(Link(link['href'], intern(link['title'])) for link in song.links),
+            description=song.description,
+            lyrics=tuple(song.lyrics),
+            error_message=str(song.error_message) if song.error_message else ""
+        )
 
 
 class Song:
-    def __init__(self, query: str) -> None:
+    def __init__(self, query: str, load: bool = True) -> None:
         self.input = query
         self.is_link = bool()
         self.query = self._query(query)
@@ -23,9 +155,36 @@ class Song:
         self.links = []
         self.description = ""
         self.lyrics = []
-    
-        self.links_found = self.__get_sites() if not self.is_link else None
-        self.lyrics_found = self.__get_lyrics() if self.is_link else None
+
+        self.links_found = None
+        self.lyrics_found = None
+
+        if load:
+            self._request(self.url)
+            self._parse()
+            self.content = None
+
+    @classmethod
+    async def fetch(cls, query: str, client, priority: int = PAGE) -> "Song":
+        # Async variant of Song(query): the request goes through the shared FandomClient
+        # and parsing runs in a worker thread so the event loop is never blocked.
+        song = cls(query, load=False)
+        try:
+            content = await client.get(song.url, priority=priority)
+        except FandomError as e:
+            song.error_message = e
+            return song
+        await song.parse(content)
+        return song
+
+    async def parse(self, content: bytes) -> None:
+        await asyncio.to_thread(self._parse_content, content)
+
+    @property
+    def url(self) -> str:
+        if self.is_link:
+            return self.query
+        return f"https://vocaloidlyrics.fandom.com/wiki/Special:Search?query={self.query}"
 
 
     def _query(self, query):
@@ -36,18 +195,52 @@ class Song:
 
     def _request(self, url: str) -> object|None:
         try:
-            response = r.get(url)
-            response.raise_for_status()
-            data = bs(response.content, 'html.parser')
-            self.content = data
+            if not self.is_link:
+                response = r.get(url)
+                response.raise_for_status()
+                self._load(response.content)
+                return None
+
+            # Song pages are streamed and cut off once the infobox and lyrics have arrived
+            with r.get(url, stream=True) as response:
+                response.raise_for_status()
+                until = self.end_detector()
+                content = bytearray()
+                for chunk in response.iter_content(65536):
+                    content += chunk
+                    if until(chunk):
+                        break
+            self._load(bytes(content))
         except r.exceptions.RequestException as e:
             self.error_message = e
             return None
 
+    def end_detector(self) -> PageEndDetector|None:
+        """Callable that's fed the page as it downloads and says when the rest can be skipped."""
+        return PageEndDetector() if self.is_link else None
+
+    def _load(self, content: bytes) -> None:
+        strainer = PAGE_STRAINER if self.is_link else SEARCH_STRAINER
+        self.content = bs(content, PARSER, parse_only=strainer)
+
+    def _parse(self) -> None:
+        if self.is_link:
+            self.lyrics_found = self.__get_lyrics()
+        else:
+            self.links_found = self.__get_sites()
+
+    def _parse_content(self, content: bytes) -> None:
+        self._load(content)
+        self._parse()
+        # Everything needed has been extracted, don't keep the tree alive with the song
+        self.content.decompose()
+        self.content = None
+
+    def to_record(self) -> SongRecord:
+        return SongRecord.from_song(self)
+
 
     def __get_sites(self) -> bool:
-        search_link = f"https://vocaloidlyrics.fandom.com/wiki/Special:Search?query={self.query}"
-        self._request(search_link)
         if not self.content:
             return False
         res = self.content.find('ul', class_='unified-search__results')
@@ -64,7 +257,6 @@ class Song:
 
 
     def __get_lyrics(self) -> bool:
-        self._request(self.query)
         if not self.content:
             return False
         try:
@@ -129,6 +321,8 @@ class Song:
         self.lyrics.append(lyrics.find('p').get_text())
 
     def __extract_multi_lyrics(self, lyrics) -> None:
+        # Each column collects its pieces and is joined once at the end instead of growing by +=
+        columns = []
         rows = lyrics.tbody.findAll('tr')
         for row in rows:
             cols = row.findAll('td')
@@ -137,17 +331,19 @@ class Song:
             for i, col in enumerate(cols):
                 colspan = int(col.get('colspan', 1))
 
-                while len(self.lyrics) < i + colspan:
-                    self.lyrics.append("")
+                while len(columns) < i + colspan:
+                    columns.append([])
 
                 if len(col.find_all('br')) > 0 and not col.get_text(strip=True):
-                    for i in range(len(self.lyrics)):
-                        self.lyrics[i] += "\n"
+                    for column in columns:
+                        column.append("\n")
                 else:
                     text = col.get_text()
                     text = self.apply_discord_formatting(text, style)
                     for j in range(colspan):
-                        self.lyrics[i + j] += text
+                        columns[i + j].append(text)
+
+        self.lyrics = ["".join(column) for column in columns]
 
     def apply_discord_formatting(self, text: str, style: str) -> str:
         formatted_text = text.rstrip('\n')
@@ -187,54 +383,83 @@ class Song:
         for singer in row.find_all('a'):
             self.singers.append(singer.get_text().strip())
 
-    def __extract_producers(self, row): # this is a very, very shitty chatgpt solution. FIX THIS FR
-        producer_text = row.get_text(separator="\n").strip()
-
-        # Split the text by newlines (each line represents a producer group)
-        producers_data = producer_text.split("\n")
-        # Dictionary to track producers and their roles
-        producers_dict = {}
+    def __extract_producers(self, row):
+        # One walk over the row: every <br> ends a credit line, links become names with their page,
+        # plain text outside parentheses is split on commas and text inside them is the role of the names before it
+        self.producers = [
+            {'name': name, 'role': role, 'link': link}
+            for line in self.__producer_lines(row)
+            for name, role, link in self.__parse_producer_line(line)
+        ]
 
-        # Loop over each line (producer group) and process it
-        for producer_line in producers_data:
-            producer_line = producer_line.strip()
-            if not producer_line:
+    def __producer_lines(self, row):
+        line = []
+        stack = [iter(row.children)]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
                 continue
-            
-            name = None
-            role = None
-            link = None
-
-            # Find the link if it exists (this indicates a named link)
-            link_tag = row.find('a', string=producer_line)
-            if link_tag:
-                name = link_tag.get_text().strip()
-                link = link_tag.get('href')
-                producer_line = producer_line.replace(name, "").strip()
-
-            # If the remaining text contains a role in parentheses, extract it
-            if '(' in producer_line and ')' in producer_line:
-                role = producer_line.split('(')[1].split(')')[0].strip()
-                name = producer_line.split('(')[0].strip() if not name else name
-
-            # Skip if no name (neither a link nor a valid role)
-            if not name:
+            if isinstance(child, Comment):
                 continue
+            if isinstance(child, NavigableString):
+                line.append((str(child), None))
+            elif child.name == 'br':
+                yield line
+                line = []
+            elif child.name == 'a':
+                line.append((child.get_text(), child.get('href') or ""))
+            else:
+                stack.append(iter(child.children))
+        yield line
+
+    def __parse_producer_line(self, line):
+        # Back to back groups, as in "ryo (supercell) (music)", all go to the same names
+        credits = []
+        batch = [] # Names since the last group, the next group belongs to them
+        owners = [] # Names the last group went to
+        pending = []
+        role = []
+        depth = 0
+        for text, link in line:
+            if link is not None:
+                if depth:
+                    role.append(text)
+                else:
+                    batch.extend(self.__split_names(pending))
+                    batch.append([text.strip(), link, []])
+                    pending = []
+                continue
+            for char in text:
+                if char == '(':
+                    depth += 1
+                    if depth == 1:
+                        batch.extend(self.__split_names(pending))
+                        pending = []
+                        continue
+                elif char == ')' and depth:
+                    depth -= 1
+                    if not depth:
+                        if batch:
+                            credits.extend(batch)
+                            owners, batch = batch, []
+                        for credit in owners:
+                            credit[2].append("".join(role).strip())
+                        role = []
+                        continue
+                if depth:
+                    role.append(char)
+                else:
+                    pending.append(char)
+        batch.extend(self.__split_names(pending))
+        credits.extend(batch)
 
-            # Handle multiple names listed in one line (e.g., "Mera Shiroki, nakuri")
-            names = [n.strip() for n in name.split(',')] if ',' in name else [name]
-
-            # Add to producers_dict under the correct role
-            if role not in producers_dict:
-                producers_dict[role] = {'names': [], 'link': link}
-            producers_dict[role]['names'].extend(names)
+        for name, link, roles in credits:
+            if name:
+                yield name, ", ".join(role for role in roles if role) or None, link
 
-        # Final list of producers (flatten the role-names structure)
-        self.producers = [
-            {'name': name, 'role': role, 'link': data['link']}
-            for role, data in producers_dict.items()
-            for name in data['names']
-        ]
+    def __split_names(self, pending):
+        return [[name.strip(), None, []] for name in CREDIT_SEPARATOR.split("".join(pending)) if name.strip()]
 
     def __extract_views(self, row):
         self.views = row.get_text().strip()
@@ -1,174 +1,293 @@
-import aiohttp
-import io
-from PIL import Image
+import os
+import time
+import asyncio
 
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.ui import View
 
 from .components import vocaloid_scraper as vs
-    
-
+from .components.cache import TTLCache
+from .components.fandom_client import FandomClient, FandomError
+from .components.song_provider import SongProvider, title_url
+
+
+COLOR_BUDGET = 0.5 # Seconds the first embed waits for the album color before using the default
+DEFER_AFTER = 2.0 # Seconds a button click may spend loading before it has to defer, Discord allows 3
+AUTOCOMPLETE_DEBOUNCE = float(os.getenv('LYRICS_AUTOCOMPLETE_DEBOUNCE', 0)) # Seconds to wait for the next keystroke
+LOG_TIMINGS = bool(os.getenv('LYRICS_LOG_TIMINGS')) # Print how long each /lyrics stage took
+TABS = ["Original", "Romanized", "Translated"]
+DISCOGRAPHY_CHARS = 3900 # Room for song links in a /discography embed, Discord caps descriptions at 4096
+DISCOGRAPHY_REFRESH = 1.0 # Seconds between progress edits while a discography loads
+
+# action: (label, style, row). Actions 0-2 switch lyrics tabs, 3 toggles the YouTube popout, x deletes the message
+BUTTONS = {
+    '0': ("Original", discord.ButtonStyle.primary, 1),
+    '1': ("Romanized", discord.ButtonStyle.primary, 1),
+    '2': ("Translated", discord.ButtonStyle.primary, 1),
+    '3': ("YouTube Popout", discord.ButtonStyle.secondary, 2),
+    'x': ("✖", discord.ButtonStyle.danger, 2)
+}
 
 class LyricsSession:
-    def __init__(self, interaction: discord.Interaction, query):
+    def __init__(self, interaction: discord.Interaction, search: str, provider: SongProvider, embeds: TTLCache):
         self.interaction = interaction
-        self.query = "https://vocaloidlyrics.fandom.com/wiki/" + query
+        self.provider = provider
+        self.embeds = embeds
+        self.search = search
         self.user = interaction.user
         self.msg = None
+        self.placeholder = None
 
         self.data = None
         self.color = None
-        self.external_links = None
-        self.video = None
-        self.video_msg = None
-        self.lyrics_page = None
+        self.color_task = None
 
-        #This will be revised for localization later
-        self.embed_footer = f"Requested by {self.user.display_name} • Powered by vocaloidlyrics.fandom.com"
+        self.started = time.perf_counter()
+        self.timings = {}
 
-    async def initialize(self):
-        embed = discord.Embed(
-            title=f"Fetching results for \"{self.query}\"...",
-            color=discord.Color.orange())
-        
-        self.msg = await self.interaction.followup.send(embed=embed)
-        self.data = vs.Song(self.query)
-        self.color = await self.get_average_color(self.data.image)
-        self.external_links = "\n".join([f"• [{link['title']}]({link['href']})" for link in self.data.links])
-        self.video = next((link['href'] for link in self.data.links if link['title'] == "YouTube Broadcast"), None)
-        self.lyrics_page = ["Original", 0]
-
-    async def get_average_color(self, image_url: str) -> int:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(image_url) as response:
-                image_data = await response.read()
-    
-        image = Image.open(io.BytesIO(image_data))
-        image = image.resize((100, 100)) # Resize to reduce load
-        image = image.convert("RGB")
-
-        pixels = list(image.getdata())
-        avg_color = tuple(map(lambda x: sum(x) // len(x), zip(*pixels)))
-
-        avg_color_hex = (avg_color[0] << 16) + (avg_color[1] << 8) + avg_color[2]
-        return avg_color_hex
+    async def initialize(self, lookup) -> bool:
+        # The placeholder goes out while the page is being fetched rather than before it
+        self.placeholder = asyncio.create_task(self.send_placeholder())
+        self.data = await lookup
+        self.mark("fetch")
+        await self.placeholder
 
-class LyricsView(View):
-    def __init__(self, session: LyricsSession):
-        super().__init__(timeout=600)
-        self.session = session
-        self.disable_buttons()
+        if not self.data:
+            await self.msg.delete()
+            return False
 
-    def disable_buttons(self):
-        disabled_list = [
-            self.session.lyrics_page[1] == 0,
-            self.session.lyrics_page[1] == 1 or len(self.session.data.lyrics) < 2 or self.session.data.lyrics[1] == "",
-            self.session.lyrics_page[1] == 2 or len(self.session.data.lyrics) < 3 or self.session.data.lyrics[2] == "",
-            not self.session.video
-            ]
-        for item in self.children:
-            if isinstance(item, discord.ui.Button):
-                if item.custom_id in {"0", "1", "2", "3"}:
-                    item.disabled = disabled_list[int(item.custom_id)]
+        self.color_task = asyncio.create_task(get_average_color(self.provider, self.data.image))
+        return True
 
-    def stop(self):
-        super().stop()
-        self.clear_items()
+    async def send_placeholder(self):
+        embed = discord.Embed(
+            title=f"Fetching results for \"{self.search}\"...",
+            color=discord.Color.orange())
+
+        self.msg = await self.interaction.followup.send(embed=embed)
+        self.mark("placeholder")
+
+    async def notify(self, embed: discord.Embed):
+        # Wait for the placeholder so it, not this notice, replaces the deferred response
+        if self.placeholder:
+            await self.placeholder
+        await self.interaction.followup.send(embed=embed, ephemeral=True)
+
+    async def wait_for_color(self, budget: float = COLOR_BUDGET) -> int:
+        # Buttons look the color up again on click, so a late color still shows up on the next tab switch
+        try:
+            self.color = await asyncio.wait_for(asyncio.shield(self.color_task), budget)
+        except asyncio.TimeoutError:
+            self.color = discord.Color.orange().value
+        self.mark("color")
+        return self.color
+
+    def mark(self, stage: str):
+        self.timings[stage] = time.perf_counter() - self.started
+
+    def log_timings(self):
+        if not LOG_TIMINGS:
+            return
+        stages = ", ".join(f"{stage} {elapsed:.2f}s" for stage, elapsed in self.timings.items())
+        print(f"Lyrics for {self.data.title}: {stages}")
+
+class LyricsButton(discord.ui.DynamicItem[discord.ui.Button], template=r'lyrics:(?P<action>[0-3x]):(?P<page>[0-2]):(?P<user>[0-9]+):(?P<key>[0-9a-f]+):(?P<video>[0-9]+)'):
+    """
+    Persistent lyrics button. Everything needed to handle a click (tab, current page, requester,
+    song key and popout message) lives in the custom_id, so buttons keep working after a restart.
+    """
+
+    def __init__(self, action: str, page: int, user_id: int, key: str, video_id: int = 0, disabled: bool = False):
+        self.action = action
+        self.page = page
+        self.user_id = user_id
+        self.key = key
+        self.video_id = video_id
+
+        label, style, row = BUTTONS[action]
+        super().__init__(discord.ui.Button(
+            label=label,
+            style=style,
+            row=row,
+            disabled=disabled,
+            custom_id=f"lyrics:{action}:{page}:{user_id}:{key}:{video_id}"
+        ))
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(match['action'], int(match['page']), int(match['user']), match['key'], int(match['video']))
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
-        if interaction.user != self.session.user:
+        if interaction.user.id != self.user_id:
             await interaction.response.send_message("Only the command sender can use these buttons!", ephemeral=True)
             return False
-        if not interaction.response.is_done():
-            await interaction.response.defer()
         return True
-    
-    async def lyrics_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if not await self.interaction_check(interaction):
-            return
-        self.stop()
-        self.session.lyrics_page = [button.label, int(button.custom_id)]
-        await lyrics_embed(self.session)
-        await lyrics_view(self.session)
-
-    @discord.ui.button(label="Original", row=1, custom_id='0', style=discord.ButtonStyle.primary)
-    async def original_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self.lyrics_button(interaction, button)
-
-    @discord.ui.button(label="Romanized", row=1, custom_id='1', style=discord.ButtonStyle.primary)
-    async def romanized_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self.lyrics_button(interaction, button)
-
-    @discord.ui.button(label="Translated", row=1, custom_id='2', style=discord.ButtonStyle.primary)
-    async def translated_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self.lyrics_button(interaction, button)
-
-    @discord.ui.button(label="YouTube Popout", row=2, custom_id='3', style=discord.ButtonStyle.secondary)
-    async def youtube_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if not await self.interaction_check(interaction):
-            return
-        if not self.session.video_msg:
-            self.session.video_msg = await interaction.followup.send(content=f"{self.session.video}")
-        else:
-            await self.session.video_msg.delete()
-            self.session.video_msg = None
-        await lyrics_embed(self.session)
 
-    @discord.ui.button(label="✖", row=2, style=discord.ButtonStyle.danger)
-    async def delete_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if not await self.interaction_check(interaction):
-            return
-        if self.session.video_msg:
-            await self.session.video_msg.delete()
-        await self.session.msg.delete()
+    async def callback(self, interaction: discord.Interaction):
+        cog = interaction.client.get_cog('Lyrics')
+        await cog.lyrics_button(interaction, self)
 
-async def lyrics_embed(session):
-    embed = discord.Embed(
-        url=session.data.query,
-        title=f"{session.lyrics_page[0]} lyrics for {session.data.title}",
-        color=discord.Color(session.color),
-        description=session.data.lyrics[session.lyrics_page[1]],
-    )
-
-    embed.add_field(name=f"\u200B", value="\u200B") # Padding between lyrics & extras
-    embed.add_field(name=f"═ External Links ═", value=session.external_links, inline=False)
+class LyricsView(View):
+    def __init__(self, song: vs.SongRecord, key: str, page: int, user_id: int, video_id: int = 0):
+        super().__init__(timeout=None)
+        lyrics = song.lyrics
+        disabled_list = [
+            page == 0,
+            page == 1 or len(lyrics) < 2 or lyrics[1] == "",
+            page == 2 or len(lyrics) < 3 or lyrics[2] == "",
+            not song_video(song)
+            ]
+        for action, disabled in zip("0123", disabled_list):
+            self.add_item(LyricsButton(action, page, user_id, key, video_id, disabled))
+        self.add_item(LyricsButton('x', page, user_id, key, video_id))
 
-    if not session.video_msg:
-        embed.set_image(url=session.data.image)
+def song_video(song: vs.SongRecord) -> str|None:
+    return next((link.href for link in song.links if link.title == "YouTube Broadcast"), None)
 
-    embed.set_footer(text=session.embed_footer, icon_url=session.user.avatar.url)
+async def get_average_color(provider: SongProvider, image_url: str) -> int:
+    color = await provider.colors.average_color(image_url) if image_url else None
+    return color if color is not None else discord.Color.orange().value
 
-    await session.msg.edit(embed=embed)
+def lyrics_embed(song: vs.SongRecord, page: int, color: int, user: discord.abc.User, video_shown: bool = False) -> discord.Embed:
+    embed = discord.Embed(
+        url=song.query,
+        title=f"{TABS[page]} lyrics for {song.title}",
+        color=discord.Color(color),
+        description=song.lyrics[page],
+    )
 
-async def lyrics_view(session):
-    view = LyricsView(session)
-    await session.msg.edit(view=view)
+    external_links = "\n".join([f"• [{link.title}]({link.href})" for link in song.links])
+    embed.add_field(name=f"\u200B", value="\u200B") # Padding between lyrics & extras
+    embed.add_field(name=f"═ External Links ═", value=external_links, inline=False)
+
+    if not video_shown:
+        embed.set_image(url=song.image)
+
+    #This will be revised for localization later
+    embed_footer = f"Requested by {user.display_name} • Powered by vocaloidlyrics.fandom.com"
+    embed.set_footer(text=embed_footer, icon_url=user.display_avatar.url)
+    return embed
+
+def render_embed(embeds: TTLCache, song: vs.SongRecord, key: str, page: int, color: int, user: discord.abc.User, video_shown: bool = False) -> discord.Embed:
+    # Tab switches flip between the same few embeds, so each one is only built once
+    cache_key = (key, page, color, user.id, video_shown)
+    embed = embeds.get(cache_key)
+    if embed is None:
+        embed = lyrics_embed(song, page, color, user, video_shown)
+        embeds.set(cache_key, embed)
+    return embed
+
+def discography_embed(page: str, songs: list, total: int, done: bool = False) -> discord.Embed:
+    lines = []
+    length = 0
+    for song in songs:
+        line = f"• [{song.title}]({song.query})"
+        length += len(line) + 1
+        if length > DISCOGRAPHY_CHARS:
+            break
+        lines.append(line)
+    if len(lines) < len(songs):
+        lines.append(f"...and {len(songs) - len(lines)} more")
+
+    status = f"{len(songs)} songs with lyrics" if done else f"Loading... {len(songs)} songs so far, {total} pages linked"
+    embed = discord.Embed(
+        title=f"Discography of {page.split(':', 1)[-1]}",
+        url=title_url(page),
+        description="\n".join(lines) or "\u200B",
+        color=discord.Color.orange()
+    )
+    embed.set_footer(text=f"{status} • Powered by vocaloidlyrics.fandom.com")
+    return embed
 
-async def initialize_lyrics(session):
-    if not session.data.lyrics:
+async def initialize_lyrics(session: LyricsSession):
+    song = session.data
+    if not song.lyrics:
         embed = discord.Embed(
-            title=f"No lyrics discovered for {session.data.title}",
+            title=f"No lyrics discovered for {song.title}",
             color=discord.Color.orange()
         )
         await session.msg.edit(embed=embed)
         return
-    await lyrics_embed(session)
-    await lyrics_view(session)
+
+    # Built while the album color is still being computed
+    key = session.provider.song_key(song.query)
+    view = LyricsView(song, key, 0, session.user.id)
+    session.mark("view")
+    color = await session.wait_for_color()
+    embed = render_embed(session.embeds, song, key, 0, color, session.user)
+    await session.msg.edit(embed=embed, view=view)
+    session.mark("render")
+
+    # Render the other tabs now so the first click on them doesn't have to
+    for page in range(1, min(len(song.lyrics), len(TABS))):
+        if song.lyrics[page]:
+            render_embed(session.embeds, song, key, page, color, session.user)
+    session.log_timings()
 
 class Lyrics(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.link = "https://vocaloidlyrics.fandom.com/wiki/"
-    
-    async def lyrics_fallback(self, interaction:discord.Interaction, search: str) -> str:
-        song = vs.Song(self.link + search)
+        self.client = FandomClient()
+        self.provider = SongProvider(self.client)
+        self.embeds = TTLCache(maxsize=512, ttl=600)
+
+        # Latest autocomplete work per user, a new keystroke cancels the one before it
+        self.autocompletes = {}
+        self.autocomplete_served = 0
+        self.autocomplete_cancelled = 0
+
+    async def cog_load(self):
+        await self.client.start()
+        await self.provider.start()
+        self.bot.add_dynamic_items(LyricsButton)
+        self.title_index_task.start()
+        if self.provider.mirror:
+            self.mirror_task.start()
+
+    async def cog_unload(self):
+        self.title_index_task.cancel()
+        self.mirror_task.cancel()
+        self.bot.remove_dynamic_items(LyricsButton)
+        await self.provider.close()
+        await self.client.close()
+
+    @tasks.loop(hours=12)
+    async def title_index_task(self):
+        try:
+            await self.provider.refresh_index()
+            print(f"Lyrics title index rebuilt with {len(self.provider.title_index)} titles")
+        except Exception as e:
+            print(f"Error rebuilding lyrics title index: {e}")
+
+    @tasks.loop(minutes=10)
+    async def mirror_task(self):
+        try:
+            stored, removed = await self.provider.sync_mirror()
+            if stored or removed:
+                print(f"Lyrics mirror synced: {stored} songs updated, {removed} removed")
+            if stored or removed or self.provider.lyric_index is None:
+                await self.provider.refresh_lyric_index()
+        except Exception as e:
+            print(f"Error syncing lyrics mirror: {e}")
+
+    async def lyrics_fallback(self, session: LyricsSession, search: str) -> vs.SongRecord|None:
+        # The song fetched here is the one the session renders, so a successful lookup costs one page load
+        song = await self.provider.song(self.link + search)
         if not song.error_message:
-            await interaction.response.defer()
-            return search
-        
-        song = vs.Song(search)
+            return song
+
+        links = await self.provider.search(search)
+        if not links:
+            embed = discord.Embed(
+                title=f"No results found for \"{search}\"",
+                color=discord.Color.orange()
+            )
+            await session.notify(embed)
+            return None
+
         embed = discord.Embed(
             title="I couldn't find the page you inputted.",
             description="This is likely because you didn't select an option for your query. " +
@@ -176,8 +295,70 @@ class Lyrics(commands.Cog):
             "\nI will attempt to redirect you to the first result for your query.",
             color=discord.Color.orange()
         )
-        await interaction.followup.send(embed=embed, ephemeral=True)
-        return song.links[0]["href"].replace(self.link, "")
+        await session.notify(embed)
+        return await self.provider.song(links[0]["href"])
+
+    async def lyrics_button(self, interaction: discord.Interaction, button: LyricsButton):
+        page, video_id = button.page, button.video_id
+
+        if button.action == 'x':
+            await interaction.response.defer()
+            if video_id:
+                await self.delete_popout(interaction, video_id)
+            await interaction.delete_original_response()
+            return
+
+        # A cached song answers with a single edit_message call, only a slow reload has to defer first
+        load = asyncio.ensure_future(self.button_song(interaction, button))
+        done, _ = await asyncio.wait({load}, timeout=DEFER_AFTER)
+        if not done:
+            await interaction.response.defer()
+        song, color = await load
+
+        if not song or song.error_message or not song.lyrics:
+            message = "I couldn't load this song anymore, try running the command again!"
+            if interaction.response.is_done():
+                await interaction.followup.send(message, ephemeral=True)
+            else:
+                await interaction.response.send_message(message, ephemeral=True)
+            return
+
+        popout_to_delete = None
+        if button.action == '3':
+            if video_id:
+                popout_to_delete, video_id = video_id, 0
+            else:
+                # The popout's id goes into the new buttons, so it has to exist before the edit
+                if not interaction.response.is_done():
+                    await interaction.response.defer()
+                video_msg = await interaction.followup.send(content=f"{song_video(song)}")
+                video_id = video_msg.id
+        else:
+            page = int(button.action)
+
+        embed = render_embed(self.embeds, song, button.key, page, color, interaction.user, bool(video_id))
+        view = LyricsView(song, button.key, page, button.user_id, video_id)
+        if interaction.response.is_done():
+            await interaction.edit_original_response(embed=embed, view=view)
+        else:
+            await interaction.response.edit_message(embed=embed, view=view)
+
+        if popout_to_delete:
+            await self.delete_popout(interaction, popout_to_delete)
+
+    async def button_song(self, interaction: discord.Interaction, button: LyricsButton) -> tuple:
+        # Rehydrate from the song store, or from the link in the embed if the store no longer has it
+        embeds = interaction.message.embeds if interaction.message else []
+        song = await self.provider.song_by_key(button.key, embeds[0].url if embeds else None)
+        if not song or song.error_message:
+            return song, None
+        return song, await get_average_color(self.provider, song.image)
+
+    async def delete_popout(self, interaction: discord.Interaction, video_id: int):
+        try:
+            await interaction.followup.delete_message(video_id)
+        except discord.HTTPException:
+            pass # Already deleted, or too old for this interaction to remove
 
     @app_commands.user_install
     @app_commands.allowed_installs(guilds=True, users=True)
@@ -185,31 +366,133 @@ class Lyrics(commands.Cog):
     @app_commands.command(name="lyrics", description="Enter a name of a vocaloid song to search Fandom for its lyrics!")
     @app_commands.describe(search="Enter a song name and options to select from will appear!")
     async def lyrics(self, interaction: discord.Interaction, search: str):
-        if interaction.response.is_done():
-            await interaction.response.defer()
-        search = await self.lyrics_fallback(interaction, search)
-        session = LyricsSession(interaction, search)
-        await session.initialize()
+        await interaction.response.defer()
+        session = LyricsSession(interaction, search, self.provider, self.embeds)
+        if not await session.initialize(self.lyrics_fallback(session, search)):
+            return
         await initialize_lyrics(session)
-        
+
+    @app_commands.user_install
+    @app_commands.allowed_installs(guilds=True, users=True)
+    @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
+    @app_commands.command(name="lyricsearch", description="Remember a line but not the title? Find vocaloid songs by a snippet of their lyrics!")
+    @app_commands.describe(snippet="Enter a line of the song in any language it's written in on Fandom")
+    async def lyricsearch(self, interaction: discord.Interaction, snippet: app_commands.Range[str, 1, 200]):
+        if not self.provider.lyric_index:
+            await interaction.response.send_message("Lyric search isn't available right now, try again later!", ephemeral=True)
+            return
+
+        links = await self.provider.find_by_lyrics(snippet)
+        if not links:
+            embed = discord.Embed(
+                title=f"No songs found with \"{snippet}\"",
+                color=discord.Color.orange()
+            )
+        else:
+            embed = discord.Embed(
+                title=f"Songs with \"{snippet}\"",
+                description="\n".join(f"{i}. [{song['title']}]({song['href']})" for i, song in enumerate(links, 1)),
+                color=discord.Color.orange()
+            )
+            embed.set_footer(text="Use /lyrics with one of these titles to see its lyrics")
+        await interaction.response.send_message(embed=embed)
+
+    @app_commands.user_install
+    @app_commands.allowed_installs(guilds=True, users=True)
+    @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
+    @app_commands.command(name="discography", description="List every song a vocaloid producer has lyrics for on Fandom!")
+    @app_commands.describe(producer="Enter the producer's name as it appears on Fandom")
+    async def discography(self, interaction: discord.Interaction, producer: str):
+        await interaction.response.defer()
+        try:
+            page, titles = await self.provider.producer_titles(producer)
+        except (FandomError, ValueError) as e:
+            # The interaction is already deferred, it has to get an answer or it stays "thinking"
+            print(f"Error looking up producer {producer}: {e}")
+            embed = discord.Embed(
+                title="I couldn't reach Fandom, try again later!",
+                color=discord.Color.orange()
+            )
+            await interaction.followup.send(embed=embed)
+            return
+        if not titles:
+            embed = discord.Embed(
+                title=f"No songs found for \"{producer}\"",
+                color=discord.Color.orange()
+            )
+            await interaction.followup.send(embed=embed)
+            return
+
+        songs = []
+        msg = await interaction.followup.send(embed=discography_embed(page, songs, len(titles)))
+        # Songs show up as their batches arrive instead of after the whole catalog has loaded
+        last_edit = time.monotonic()
+        async for song in self.provider.bulk_songs(titles):
+            songs.append(song)
+            if time.monotonic() - last_edit >= DISCOGRAPHY_REFRESH:
+                await msg.edit(embed=discography_embed(page, songs, len(titles)))
+                last_edit = time.monotonic()
+
+        songs.sort(key=lambda song: song.title.casefold())
+        await msg.edit(embed=discography_embed(page, songs, len(titles), done=True))
+
     @lyrics.autocomplete('search')
     async def lyrics_autocomplete(self, interaction: discord.Interaction, current: str):
         await interaction.response.defer()
         if not current:
             return [app_commands.Choice(name="Start typing to see results!", value=" ") ]
 
-        song_data = vs.Song(current)
+        user_id = interaction.user.id
+        previous = self.autocompletes.get(user_id)
+        if previous:
+            previous.cancel()
+
+        work = asyncio.ensure_future(self.autocomplete_links(current))
+        self.autocompletes[user_id] = work
+        try:
+            # wait() doesn't raise when work is cancelled by a newer keystroke, it just finishes
+            await asyncio.wait({work})
+        finally:
+            if not work.done():
+                work.cancel()
+            if self.autocompletes.get(user_id) is work:
+                del self.autocompletes[user_id]
+
+        if work.cancelled():
+            self.autocomplete_cancelled += 1
+            return [] # Discord has already moved on to the newer keystroke
+        self.autocomplete_served += 1
+
+        links = work.result()
+        self.provider.prefetch(user_id, [song["href"] for song in links])
         songs = [
             (song["title"], song["href"].replace(self.link, ""))
-            for song in song_data.links
+            for song in links
             if len(song["title"]) <= 100 and len(song["href"]) <= 100
         ]
 
         return [
-            app_commands.Choice(name=song[0], value=song[1]) 
+            app_commands.Choice(name=song[0], value=song[1])
             for song in songs
         ]
 
+    async def autocomplete_links(self, current: str) -> list:
+        try:
+            if AUTOCOMPLETE_DEBOUNCE:
+                await asyncio.sleep(AUTOCOMPLETE_DEBOUNCE)
+            return await self.provider.suggest(current)
+        except asyncio.CancelledError:
+            # Stop the search itself too, unless someone else is waiting on the same query
+            self.provider.cancel_search(current)
+            raise
+
+    def autocomplete_stats(self) -> dict:
+        return {
+            'served': self.autocomplete_served,
+            'cancelled': self.autocomplete_cancelled,
+            'in_flight': len(self.autocompletes)
+        }
+
 
 
 async def setup(bot):